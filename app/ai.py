@@ -1,28 +1,356 @@
-from typing import Dict, Optional, List
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from threading import Lock
+from typing import Any, Callable, Dict, Iterator, Optional, List, Tuple
 
+import httpx
 from openai.types.chat import ChatCompletionMessageParam
 from openai import OpenAI
 
 
-class TextGenerator:
-    def __init__(self, model: str, key: str) -> None:
-        self.client = None
-        self.model = model
-        self.key = key
-        self._initialize_model()
+# Rough size of a prompt without calling a tokenizer; Cyrillic text averages
+# about three characters per token, so this errs on the large side
+CHARS_PER_TOKEN = 3
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Tool call round trips allowed before the model has to answer
+MAX_TOOL_ROUNDS = 3
+
+
+def estimate_tokens(messages: List[Dict[str, str]]) -> int:
+    return sum(
+        len(message["content"]) // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+        for message in messages
+    )
+
+
+class BackendUnavailable(Exception):
+    pass
+
+
+class Backend:
+    # One OpenAI-compatible endpoint and model together with its health:
+    # average latency, error counts and a circuit breaker that takes the
+    # backend out of rotation after several failures in a row
+
+    # Weight of the newest call in the latency average
+    LATENCY_SMOOTHING = 0.3
 
-    def _initialize_model(self) -> None:
+    def __init__(
+        self,
+        name: str,
+        base_url: str,
+        key: str,
+        model: str,
+        http_client: httpx.Client,
+    ) -> None:
+        self.name = name
+        self.model = model
         self.client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=self.key
+            base_url=base_url,
+            api_key=key,
+            http_client=http_client,
+            # Retries go to the next backend instead, see TextGenerator
+            max_retries=0
         )
+        self.latency: Optional[float] = None
+        self.calls = 0
+        self.errors = 0
+        self.failures = 0
+        self.open_until = 0.0
+        self._lock = Lock()
 
-    def generate(self, history: List[ChatCompletionMessageParam]) -> str:
-        completion = self.client.chat.completions.create(
+    def available(self, now: float) -> bool:
+        # Once the cooldown passes the backend gets traffic again; a single
+        # failure then reopens the breaker because failures was not reset
+        return self.open_until <= now
+
+    def rank(self) -> Tuple[float, float]:
+        error_rate = self.errors / self.calls if self.calls else 0.0
+        return (error_rate, self.latency or 0.0)
+
+    def record_success(self, seconds: float) -> None:
+        with self._lock:
+            self.calls += 1
+            self.failures = 0
+            if self.latency is None:
+                self.latency = seconds
+            else:
+                self.latency += self.LATENCY_SMOOTHING * (seconds - self.latency)
+
+    def record_failure(self, threshold: int, cooldown: float) -> None:
+        with self._lock:
+            self.calls += 1
+            self.errors += 1
+            self.failures += 1
+            if self.failures >= threshold:
+                self.open_until = time.monotonic() + cooldown
+
+    def create(
+        self,
+        history: List[ChatCompletionMessageParam],
+        stream: bool,
+        tools: Optional[List[Dict[str, Any]]] = None,
+    ):
+        extra: Dict[str, Any] = {"tools": tools} if tools else {}
+        if stream:
+            # Ask for token counts in the final chunk
+            extra["stream_options"] = {"include_usage": True}
+        return self.client.chat.completions.create(
             model=self.model,
             messages=history,
             max_tokens=2048,
             temperature=0.7,
+            stream=stream,
+            **extra,
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "model": self.model,
+            "latency": self.latency,
+            "calls": self.calls,
+            "errors": self.errors,
+            "open": not self.available(time.monotonic()),
+        }
+
+
+def _close_stream(backend: "Backend", future: Future) -> None:
+    # Hedged streams that lost the race still hold an HTTP connection. The
+    # backend did answer, which counts as its success; failures were
+    # recorded when the stream failed to open.
+    if not future.cancelled() and future.exception() is None:
+        chunks, _, _, latency = future.result()
+        backend.record_success(latency)
+        chunks.close()
+
+
+class TextGenerator:
+    # Routes completions over several backends. The healthiest backend is
+    # tried first; if it has not answered after hedge_after seconds the same
+    # request is also sent to the next one and whichever answers first wins.
+    # Failed attempts move on to the next backend, up to retries times. A
+    # request is never sent to the same backend twice, so with a single
+    # backend there is no hedging and no retry.
+
+    def __init__(
+        self,
+        backends: List[Dict[str, str]],
+        timeout: float = 60.0,
+        hedge_after: float = 8.0,
+        retries: int = 1,
+        breaker_failures: int = 3,
+        breaker_cooldown: float = 30.0,
+        max_connections: int = 20,
+    ) -> None:
+        self.hedge_after = hedge_after
+        self.retries = retries
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        # One connection pool shared by every backend
+        self.http_client = httpx.Client(
+            timeout=httpx.Timeout(timeout, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+        )
+        self.backends = [
+            Backend(
+                name=backend.get("name", backend["model"]),
+                base_url=backend["base_url"],
+                key=backend["key"],
+                model=backend["model"],
+                http_client=self.http_client,
+            )
+            for backend in backends
+        ]
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_connections, thread_name_prefix="llm"
         )
+
+    @property
+    def model(self) -> str:
+        return self.backends[0].model
+
+    def generate(self, history: List[ChatCompletionMessageParam]) -> str:
+        _, completion = self._race(lambda backend: backend.create(history, stream=False))
         content = completion.choices[0].message.content
-        return content
\ No newline at end of file
+        return content
+
+    def stream(
+        self,
+        history: List[ChatCompletionMessageParam],
+        tools: Optional[List[Dict[str, Any]]] = None,
+        run_tool: Optional[Callable[[str, str], str]] = None,
+        usage: Optional[Dict[str, Any]] = None,
+    ) -> Iterator[str]:
+        # Yields pieces of the answer as soon as the model produces them.
+        # When tools are given, tool calls requested by the model are run
+        # with run_tool(name, arguments) and the answer continues with their
+        # results; the last round is sent without tools so it must answer.
+        # If usage is given it receives the backend, model and token counts
+        # reported by the backend, summed over all rounds.
+        usage = {} if usage is None else usage
+        messages = list(history)
+        for round_number in range(MAX_TOOL_ROUNDS + 1):
+            offered = tools if round_number < MAX_TOOL_ROUNDS else None
+            calls: Dict[int, Dict[str, Any]] = {}
+            for kind, value in self._stream_round(messages, offered, usage):
+                if kind == "text":
+                    yield value
+                    continue
+                if kind == "usage":
+                    for name in ("prompt_tokens", "completion_tokens"):
+                        usage[name] = usage.get(name, 0) + (getattr(value, name, 0) or 0)
+                    continue
+                call = calls.setdefault(value.index, {
+                    "id": "", "type": "function", "function": {"name": "", "arguments": ""},
+                })
+                call["id"] += value.id or ""
+                if value.function:
+                    call["function"]["name"] += value.function.name or ""
+                    call["function"]["arguments"] += value.function.arguments or ""
+            if not calls:
+                return
+            requested = [calls[index] for index in sorted(calls)]
+            messages.append({"role": "assistant", "content": None, "tool_calls": requested})
+            for call in requested:
+                messages.append({
+                    "role": "tool",
+                    "tool_call_id": call["id"],
+                    "content": run_tool(call["function"]["name"], call["function"]["arguments"]),
+                })
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [backend.stats() for backend in self.backends]
+
+    def _stream_round(
+        self,
+        history: List[ChatCompletionMessageParam],
+        tools: Optional[List[Dict[str, Any]]],
+        usage: Dict[str, Any],
+    ) -> Iterator[Tuple[str, Any]]:
+        # Hedging is decided on the first event; after that the stream is
+        # bound to one backend
+        backend, (chunks, events, first, latency) = self._race(
+            lambda backend: self._open_stream(backend, history, tools),
+            on_lost=_close_stream,
+            streaming=True,
+        )
+        usage["backend"] = backend.name
+        usage["model"] = backend.model
+        # One outcome per call, known once the stream ends: a failure
+        # mid-stream, or success with the latency of the first event
+        failed = False
+        try:
+            if first is not None:
+                yield first
+            yield from events
+        except Exception:
+            failed = True
+            backend.record_failure(self.breaker_failures, self.breaker_cooldown)
+            raise
+        finally:
+            if not failed:
+                backend.record_success(latency)
+            # Releases the HTTP connection when the consumer stops early
+            chunks.close()
+
+    def _open_stream(
+        self,
+        backend: Backend,
+        history: List[ChatCompletionMessageParam],
+        tools: Optional[List[Dict[str, Any]]],
+    ):
+        started = time.monotonic()
+        chunks = backend.create(history, stream=True, tools=tools)
+        events = self._events(chunks)
+        try:
+            first = next(events, None)
+        except Exception:
+            chunks.close()
+            raise
+        return chunks, events, first, time.monotonic() - started
+
+    @staticmethod
+    def _events(chunks) -> Iterator[Tuple[str, Any]]:
+        # ("text", piece of the answer), ("tool", fragment of a tool call)
+        # or ("usage", token counts of the round)
+        for chunk in chunks:
+            if getattr(chunk, "usage", None):
+                yield "usage", chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                yield "text", delta.content
+            for tool_call in delta.tool_calls or ():
+                yield "tool", tool_call
+
+    def _attempts(self) -> List[Backend]:
+        now = time.monotonic()
+        ready = sorted(
+            (backend for backend in self.backends if backend.available(now)),
+            key=Backend.rank,
+        )
+        if not ready:
+            raise BackendUnavailable("All language model backends are failing.")
+        # Distinct backends only: a slow or failing backend gets nothing
+        # from a second copy of the same request
+        return ready[:1 + self.retries]
+
+    def _timed(self, backend: Backend, call: Callable[[Backend], Any], streaming: bool) -> Any:
+        # Streams that opened record their outcome when they end instead
+        started = time.monotonic()
+        try:
+            result = call(backend)
+        except Exception:
+            backend.record_failure(self.breaker_failures, self.breaker_cooldown)
+            raise
+        if not streaming:
+            backend.record_success(time.monotonic() - started)
+        return result
+
+    def _race(
+        self,
+        call: Callable[[Backend], Any],
+        on_lost: Optional[Callable[[Backend, Future], None]] = None,
+        streaming: bool = False,
+    ) -> Tuple[Backend, Any]:
+        attempts = self._attempts()
+        running: Dict[Future, Backend] = {}
+        error: Optional[Exception] = None
+
+        def launch() -> None:
+            backend = attempts.pop(0)
+            running[self._executor.submit(self._timed, backend, call, streaming)] = backend
+
+        launch()
+        while running:
+            done, _ = wait(
+                running,
+                timeout=self.hedge_after if attempts else None,
+                return_when=FIRST_COMPLETED,
+            )
+            if not done:
+                # The current attempts are slow, hedge on the next backend
+                launch()
+                continue
+            for future in done:
+                backend = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as exc:
+                    error = exc
+                    if attempts and not running:
+                        launch()
+                    continue
+                if on_lost is not None:
+                    for other, loser in running.items():
+                        other.add_done_callback(
+                            lambda future, loser=loser: on_lost(loser, future)
+                        )
+                return backend, result
+        raise error
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import re
+from threading import Lock
+from typing import Dict, List, Optional, Set, Tuple, Type
+
+from .changes import Changes
+from .models import (
+    Company,
+    Department,
+    Employee,
+    KBRecord,
+    KnowledgeBase,
+    Project,
+    Task,
+)
+from .store import Store
+
+
+# Commits touching these models may change what the assistant would answer
+WATCHED_MODELS = (Company, Department, Employee, KBRecord, KnowledgeBase, Project, Task)
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Store keys of the data versions shared by all worker processes: one per
+# company, and one for all of them, bumped when the company of a change
+# cannot be told because its rows were deleted
+VERSION_KEY = "answer_cache:version"
+COMPANY_VERSION_KEY = "answer_cache:version:{}"
+
+# (company id, data version, conversation digest, normalized question)
+Key = Tuple[int, str, str, str]
+
+
+def _companies(model: Type, ids: Set[int]) -> Tuple[Set[int], bool]:
+    # Companies of the changed rows, and whether every row was found
+    if model is Company:
+        query = Company.query.with_entities(Company.id, Company.id)
+    elif model is Task:
+        query = Task.query.outerjoin(Project).with_entities(Task.id, Project.company_id)
+    elif model is KBRecord:
+        query = KBRecord.query.join(KnowledgeBase).with_entities(
+            KBRecord.id, KnowledgeBase.company_id
+        )
+    else:
+        query = model.query.with_entities(model.id, model.company_id)
+    rows = query.filter(model.id.in_(ids)).all()
+    # Tasks without a project belong to no company's answers
+    return {company_id for _, company_id in rows if company_id is not None}, len(rows) == len(ids)
+
+
+def normalize(question: str) -> str:
+    return " ".join(WORD_RE.findall(question.lower().replace("ё", "е")))
+
+
+class AnswerCache:
+    # Answers to questions, kept in the shared store and keyed on the
+    # company, the normalized question, the data version and a digest of the
+    # asker's earlier turns, since a follow-up like "а кто из них в отпуске?"
+    # means something else in every conversation. Questions that open a
+    # conversation share one empty digest across users. A commit to
+    # company data bumps that company's version, which makes its older
+    # answers unreachable at once; the store expires them after ttl seconds.
+    # Commit listeners cannot query, so changes are queued and resolved to
+    # companies before the next lookup.
+
+    def __init__(self, store: Store, ttl: float, min_words: int) -> None:
+        self.store = store
+        self.ttl = ttl
+        self.min_words = min_words
+        self._lock = Lock()
+        self._pending: Dict[Type, Set[int]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def version(self) -> int:
+        return self.store.get(VERSION_KEY) or 0
+
+    def company_version(self, company_id: int) -> str:
+        company = self.store.get(COMPANY_VERSION_KEY.format(company_id)) or 0
+        return f"{self.version}.{company}"
+
+    def key(self, company_id: int, question: str, history: List[Dict[str, str]]) -> Optional[Key]:
+        # Short questions like "а ещё?" are rarely repeated as they are; skip them
+        text = normalize(question)
+        if len(text.split()) < self.min_words:
+            return None
+        self._apply_pending()
+        context = ""
+        if history:
+            context = hashlib.sha1(
+                json.dumps(history, ensure_ascii=False, sort_keys=True).encode()
+            ).hexdigest()
+        return (company_id, self.company_version(company_id), context, text)
+
+    def get(self, key: Key) -> Optional[str]:
+        answer = self.store.get(self._name(key))
+        with self._lock:
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return answer
+
+    def put(self, key: Key, answer: str) -> None:
+        # The data changed while the answer was being generated
+        self._apply_pending()
+        if key[1] != self.company_version(key[0]):
+            return
+        self.store.set(self._name(key), answer, ttl=self.ttl)
+
+    def invalidate(self, changes: Changes) -> None:
+        with self._lock:
+            for model in WATCHED_MODELS:
+                ids = changes.get(model)
+                if ids:
+                    self._pending.setdefault(model, set()).update(ids)
+
+    def stats(self) -> Dict[str, float]:
+        # Lookups counted by this process
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "version": self.version,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _apply_pending(self) -> None:
+        # Needs an app context
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        companies: Set[int] = set()
+        everyone = False
+        for model, ids in pending.items():
+            found, complete = _companies(model, ids)
+            companies |= found
+            everyone = everyone or not complete
+        if everyone:
+            self.store.incr(VERSION_KEY)
+            return
+        for company_id in companies:
+            self.store.incr(COMPANY_VERSION_KEY.format(company_id))
+
+    def _name(self, key: Key) -> str:
+        company_id, version, context, text = key
+        return f"answer:{company_id}:{version}:{context}:{text}"
@@ -0,0 +1,158 @@
+from datetime import datetime
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import delete, event, func, insert, inspect
+from sqlalchemy.orm import Session
+
+from .loading import profile
+from .models import db, Project, Task, TaskChange
+
+
+# Changes kept in task_change; clients whose cursor is older reload the board
+CHANGE_LOG_SIZE = 100_000
+PRUNE_EVERY = 1000
+
+# More changed tasks than this are sent as a full reload instead
+MAX_DELTA_TASKS = 500
+
+# Where ids can commit out of order (PostgreSQL sequences: a transaction
+# that took a lower id may commit after one with a higher id), deltas also
+# re-read this many ids below the client's cursor, so a late commit is not
+# skipped. Tasks already delivered are just sent again.
+REREAD_WINDOW = 1000
+
+_logged = 0
+_logged_lock = Lock()
+
+
+def task_card(task: Task) -> Dict[str, Any]:
+    # Everything a kanban card shows
+    return {
+        "id": task.id,
+        "name": task.name,
+        "status": task.status.value,
+        "index": task.index,
+        "version": task.version,
+        "project_id": task.project_id,
+        "employees": [
+            {"index": employee.index, "id": employee.id, "full_name": employee.full_name}
+            for employee in task.employees
+        ],
+    }
+
+
+def _projects(task: Task) -> Set[Optional[int]]:
+    # A task moved to another project leaves the old project's board too
+    history = inspect(task).attrs.project_id.history
+    return {task.project_id, *history.deleted}
+
+
+@event.listens_for(Session, "after_flush")
+def _log_task_changes(session: Session, flush_context) -> None:
+    # Written in the flushing transaction, so the log commits or rolls back
+    # together with the task changes it records
+    global _logged
+    rows = []
+    for task in session.new | session.dirty | session.deleted:
+        if not isinstance(task, Task) or task.id is None:
+            continue
+        if task in session.dirty and not session.is_modified(task):
+            continue
+        now = datetime.utcnow()
+        rows.extend(
+            {"task_id": task.id, "project_id": project_id, "created_at": now}
+            for project_id in _projects(task)
+        )
+    if not rows:
+        return
+    connection = session.connection()
+    connection.execute(insert(TaskChange), rows)
+    with _logged_lock:
+        _logged += len(rows)
+        prune = _logged >= PRUNE_EVERY
+        if prune:
+            _logged = 0
+    if prune:
+        newest = connection.execute(func.max(TaskChange.id).select()).scalar()
+        connection.execute(delete(TaskChange).where(TaskChange.id <= newest - CHANGE_LOG_SIZE))
+
+
+def _in_order() -> bool:
+    # Writers are serialized on SQLite, so ids become visible in order
+    return db.session.get_bind().dialect.name == "sqlite"
+
+
+def cursor() -> int:
+    return TaskChange.query.with_entities(func.max(TaskChange.id)).scalar() or 0
+
+
+def revision() -> str:
+    # Changes whenever a change is committed. Elsewhere than on SQLite a late
+    # commit below the newest id leaves the cursor alone, so the row count
+    # is part of it too.
+    if _in_order():
+        return str(cursor())
+    newest, count = TaskChange.query.with_entities(
+        func.max(TaskChange.id), func.count(TaskChange.id)
+    ).one()
+    return f"{newest or 0}.{count}"
+
+
+def _tasks(company_id: int, project_id: Optional[int]):
+    query = Task.query.join(Project).filter(Project.company_id == company_id)
+    if project_id:
+        query = query.filter(Task.project_id == project_id)
+    return query.options(*profile("task_board"))
+
+
+def board(company_id: int, project_id: Optional[int] = None) -> Dict[str, Any]:
+    # The cursor is read first, so a change made while the tasks are being
+    # read is delivered again by the next delta instead of being missed
+    position = cursor()
+    return {
+        "cursor": position,
+        "tasks": [task_card(task) for task in _tasks(company_id, project_id)],
+    }
+
+
+def changes_since(
+    company_id: int,
+    since: int,
+    project_id: Optional[int] = None,
+) -> Dict[str, Any]:
+    # Current cards of the tasks changed after the cursor and the ids of
+    # those no longer on this board. "reset" tells the client to reload the
+    # whole board: its cursor was pruned from the log, comes from another
+    # database, or the delta is too large to be worth it.
+    position = cursor()
+    oldest = TaskChange.query.with_entities(func.min(TaskChange.id)).scalar()
+    if since > position or (oldest is not None and since < oldest - 1):
+        return {"cursor": position, "reset": True}
+    lowest = since if _in_order() else since - REREAD_WINDOW
+    changes = TaskChange.query.filter(
+        TaskChange.id > lowest,
+        TaskChange.id <= position,
+        TaskChange.project_id.in_(
+            Project.query.filter(Project.company_id == company_id).with_entities(Project.id)
+        ),
+    )
+    if project_id:
+        changes = changes.filter(TaskChange.project_id == project_id)
+    changed = {task_id for task_id, in changes.with_entities(TaskChange.task_id).distinct()}
+    if len(changed) > MAX_DELTA_TASKS:
+        return {"cursor": position, "reset": True}
+    cards = _cards(company_id, project_id, changed)
+    return {
+        "cursor": position,
+        "reset": False,
+        "tasks": cards,
+        "removed": sorted(changed - {card["id"] for card in cards}),
+    }
+
+
+def _cards(company_id: int, project_id: Optional[int], ids: Iterable[int]) -> List[Dict[str, Any]]:
+    ids = list(ids)
+    if not ids:
+        return []
+    return [task_card(task) for task in _tasks(company_id, project_id).filter(Task.id.in_(ids))]
@@ -0,0 +1,102 @@
+import uuid
+from typing import Callable, Dict, Iterable, List, Optional, Set, Type
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+
+# Models whose changes are reported to listeners, e.g. {Employee: {1, 2}}
+Changes = Dict[Type, Set[int]]
+Listener = Callable[[Changes], None]
+
+_listeners: List[Listener] = []
+
+# Channel that carries the changes of one process's commits to the others
+CHANNEL = "changes"
+
+# Tells this process's own messages apart from those of other processes
+_origin = uuid.uuid4().hex
+_publish: Optional[Listener] = None
+
+
+def on_commit(listener: Listener) -> Listener:
+    # Register a function that is called after every successful commit
+    # with the ids of the rows that were inserted, updated or deleted.
+    _listeners.append(listener)
+    return listener
+
+
+def share(store, models: Iterable[Type]) -> None:
+    # Publish the changes of every commit through the store and report those
+    # of other worker processes to this process's listeners too, so caches
+    # built from the database stay coherent across processes
+    global _publish
+    by_table = {model.__tablename__: model for model in models}
+
+    def publish(changes: Changes) -> None:
+        store.publish(CHANNEL, {
+            "origin": _origin,
+            "changes": {model.__tablename__: sorted(ids) for model, ids in changes.items()},
+        })
+
+    def receive(message) -> None:
+        if message["origin"] == _origin:
+            return
+        _notify({
+            by_table[table]: set(ids)
+            for table, ids in message["changes"].items()
+            if table in by_table
+        })
+
+    store.subscribe(CHANNEL, receive)
+    _publish = publish
+
+
+def _notify(changes: Changes) -> None:
+    for listener in _listeners:
+        listener(changes)
+
+
+def _pending(session: Session) -> Changes:
+    return session.info.setdefault("changed_rows", {})
+
+
+def _changed(session: Session, obj) -> bool:
+    # Its own columns, or a many-to-many collection (rows of an association
+    # table). A one-to-many collection such as Employee.sent_messages only
+    # changes when a row on the other side sets its foreign key, and that
+    # row is reported itself.
+    if session.is_modified(obj, include_collections=False):
+        return True
+    state = inspect(obj)
+    return any(
+        relationship.secondary is not None
+        and state.attrs[relationship.key].history.has_changes()
+        for relationship in state.mapper.relationships
+    )
+
+
+@event.listens_for(Session, "after_flush")
+def _collect(session: Session, flush_context) -> None:
+    pending = _pending(session)
+    dirty = [obj for obj in session.dirty if _changed(session, obj)]
+    for obj in list(session.new) + dirty + list(session.deleted):
+        obj_id = getattr(obj, "id", None)
+        if obj_id is None:
+            continue
+        pending.setdefault(type(obj), set()).add(obj_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _dispatch(session: Session) -> None:
+    changes = session.info.pop("changed_rows", None)
+    if not changes:
+        return
+    _notify(changes)
+    if _publish is not None:
+        _publish(changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session: Session) -> None:
+    session.info.pop("changed_rows", None)
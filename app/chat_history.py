@@ -0,0 +1,42 @@
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import tuple_
+from sqlalchemy.orm import joinedload
+
+from .models import Message
+
+
+def encode_cursor(message: Message) -> str:
+    return f"{message.timestamp.isoformat()}_{message.id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    # Raises ValueError on a malformed cursor
+    timestamp, _, message_id = cursor.rpartition("_")
+    return datetime.fromisoformat(timestamp), int(message_id)
+
+
+def page(
+    chat_id: int,
+    limit: int,
+    before: Optional[str] = None,
+) -> Tuple[List[Message], Optional[str]]:
+    # One page of a chat's messages, oldest first, ending just before the
+    # cursor (or at the newest message), and the cursor of the next older
+    # page. The (timestamp, id) keyset walks ix_message_chat_time, so every
+    # page costs the same no matter how long the history is.
+    query = (
+        Message.query
+        .filter(Message.chat_id == chat_id)
+        .options(joinedload(Message.sender))
+        .order_by(Message.timestamp.desc(), Message.id.desc())
+    )
+    if before:
+        query = query.filter(
+            tuple_(Message.timestamp, Message.id) < tuple_(*decode_cursor(before))
+        )
+    # One extra row tells whether an older page exists
+    messages = query.limit(limit + 1).all()
+    older = encode_cursor(messages[limit - 1]) if len(messages) > limit else None
+    return list(reversed(messages[:limit])), older
@@ -0,0 +1,101 @@
+from threading import Lock
+from typing import Dict, List, Set, Type
+
+from sqlalchemy.orm import selectinload
+
+from .changes import Changes
+from .models import Department, Employee, Project, Task
+
+
+# Relationships read by to_dict(), loaded in bulk instead of once per row
+LOAD_OPTIONS = {
+    Employee: (
+        selectinload(Employee.departments),
+        selectinload(Employee.projects),
+        selectinload(Employee.tasks),
+        selectinload(Employee.events),
+        selectinload(Employee.chats),
+    ),
+    Project: (
+        selectinload(Project.employees),
+        selectinload(Project.tasks),
+    ),
+    Department: (
+        selectinload(Department.employees),
+        selectinload(Department.projects),
+    ),
+    Task: (
+        selectinload(Task.employees),
+    ),
+}
+
+Snapshot = Dict[Type, Dict[int, str]]
+
+
+def _company_query(model: Type, company_id: int):
+    query = model.query.options(*LOAD_OPTIONS[model])
+    if model is Task:
+        return query.join(Project).filter(Project.company_id == company_id)
+    return query.filter(model.company_id == company_id)
+
+
+class CompanyContextCache:
+    # Rendered company rows for the assistant prompt, one snapshot per company.
+    # A snapshot is built on first use and kept in memory. Commits only mark
+    # the affected rows as stale, and those rows are re-rendered on the next
+    # read, so an edit costs one small query instead of a full rebuild.
+
+    def __init__(self) -> None:
+        self._snapshots: Dict[int, Snapshot] = {}
+        self._stale: Dict[int, Dict[Type, Set[int]]] = {}
+        self._lock = Lock()
+
+    def rows(self, company_id: int, model: Type) -> List[str]:
+        with self._lock:
+            snapshot = self._snapshots.get(company_id)
+            if snapshot is None:
+                snapshot = self._build(company_id)
+                self._snapshots[company_id] = snapshot
+                self._stale[company_id] = {}
+            else:
+                self._refresh(company_id, snapshot)
+            return list(snapshot[model].values())
+
+    def invalidate(self, changes: Changes) -> None:
+        with self._lock:
+            for stale in self._stale.values():
+                for model in LOAD_OPTIONS:
+                    ids = changes.get(model)
+                    if ids:
+                        stale.setdefault(model, set()).update(ids)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._snapshots.clear()
+            self._stale.clear()
+
+    def _build(self, company_id: int) -> Snapshot:
+        return {
+            model: {
+                row.id: str(row)
+                for row in _company_query(model, company_id).order_by(model.id)
+            }
+            for model in LOAD_OPTIONS
+        }
+
+    def _refresh(self, company_id: int, snapshot: Snapshot) -> None:
+        stale = self._stale[company_id]
+        for model, ids in stale.items():
+            rows = snapshot[model]
+            for row_id in ids:
+                rows.pop(row_id, None)
+            query = (
+                _company_query(model, company_id)
+                .filter(model.id.in_(ids))
+                .execution_options(populate_existing=True)
+            )
+            for row in query:
+                rows[row.id] = str(row)
+            # Keep the prompt order stable after re-rendering
+            snapshot[model] = dict(sorted(rows.items()))
+        stale.clear()
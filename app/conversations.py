@@ -0,0 +1,104 @@
+from typing import Dict, List
+
+from .ai import estimate_tokens
+from .models import db, AssistantMessage
+from .store import Store
+
+
+SUMMARY_QUESTION_LENGTH = 120
+SUMMARY_MAX_QUESTIONS = 10
+
+
+class ConversationStore:
+    # Assistant conversations saved in the assistant_message table, with the
+    # latest turns of recently active users kept in the shared store so any
+    # worker process can answer the next question. Users idle for longer
+    # than idle_seconds expire from the store and are reloaded from the
+    # database on their next question.
+
+    def __init__(
+        self,
+        store: Store,
+        max_messages: int,
+        idle_seconds: float,
+        token_budget: int,
+    ) -> None:
+        self.store = store
+        self.max_messages = max_messages
+        self.idle_seconds = idle_seconds
+        self.token_budget = token_budget
+
+    def history(self, user_id: int) -> List[Dict[str, str]]:
+        recent = self.store.get(self._key(user_id))
+        if recent is None:
+            rows = (
+                AssistantMessage.query
+                .filter(AssistantMessage.user_id == user_id)
+                .order_by(AssistantMessage.id.desc())
+                .limit(self.max_messages)
+                .all()
+            )
+            recent = [row.to_dict() for row in reversed(rows)]
+        # Written back on every read to restart the idle timer
+        self.store.set(self._key(user_id), recent, ttl=self.idle_seconds)
+        return recent
+
+    def append(self, user_id: int, *turns: Dict[str, str]) -> None:
+        db.session.add_all(
+            AssistantMessage(user_id=user_id, role=turn["role"], content=turn["content"])
+            for turn in turns
+        )
+        db.session.commit()
+        recent = self.store.get(self._key(user_id))
+        if recent is not None:
+            recent = (recent + list(turns))[-self.max_messages:]
+            self.store.set(self._key(user_id), recent, ttl=self.idle_seconds)
+
+    def clear(self, user_id: int) -> None:
+        AssistantMessage.query.filter(AssistantMessage.user_id == user_id).delete()
+        db.session.commit()
+        self.store.delete(self._key(user_id))
+
+    def prompt(
+        self,
+        user_id: int,
+        system: List[Dict[str, str]],
+        question: Dict[str, str],
+    ) -> List[Dict[str, str]]:
+        # System messages and the question always go in; earlier turns are
+        # added newest first while they fit in the token budget, and the
+        # questions that did not fit are listed in one short summary line
+        history = self.history(user_id)
+        budget = self.token_budget - estimate_tokens(system + [question])
+        kept: List[Dict[str, str]] = []
+        # Walk back in question/answer pairs so a turn is never split
+        index = len(history)
+        while index > 0:
+            start = index - 1
+            while start > 0 and history[start]["role"] != "user":
+                start -= 1
+            turn = history[start:index]
+            cost = estimate_tokens(turn)
+            if cost > budget:
+                break
+            budget -= cost
+            kept[:0] = turn
+            index = start
+        summary = self._summarize(history[:index])
+        return system + summary + kept + [question]
+
+    def _summarize(self, dropped: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        questions = [m["content"] for m in dropped if m["role"] == "user"]
+        if not questions:
+            return []
+        questions = questions[-SUMMARY_MAX_QUESTIONS:]
+        lines = "\n".join(
+            "- " + question[:SUMMARY_QUESTION_LENGTH] for question in questions
+        )
+        return [{
+            "role": "system",
+            "content": "Ранее в этом разговоре пользователь спрашивал:\n" + lines,
+        }]
+
+    def _key(self, user_id: int) -> str:
+        return f"conversation:{user_id}"
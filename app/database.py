@@ -0,0 +1,77 @@
+import os
+from typing import Any, Dict
+
+from sqlalchemy import MetaData, event, inspect, text
+from sqlalchemy.engine import Engine, make_url
+
+import config
+
+
+# Columns added to existing tables after they were first released, with
+# their DDL; db.create_all() only creates tables that are missing
+ADDED_COLUMNS = {
+    "task": {"version": "INTEGER NOT NULL DEFAULT 1"},
+}
+
+
+def database_url() -> str:
+    # DATABASE_URL in the environment wins, so the seeder, the app and the
+    # benchmarks can be pointed at another database without editing config.py
+    return os.environ.get("DATABASE_URL", config.database_url)
+
+
+def engine_options(url: str) -> Dict[str, Any]:
+    backend = make_url(url).get_backend_name()
+    if backend == "postgresql":
+        # pre_ping replaces connections the server closed while idle
+        return {
+            "pool_size": config.db_pool_size,
+            "max_overflow": config.db_max_overflow,
+            "pool_recycle": config.db_pool_recycle,
+            "pool_timeout": config.db_pool_timeout,
+            "pool_pre_ping": True,
+        }
+    return {}
+
+
+def configure(app) -> None:
+    # Call before db.init_app(app)
+    url = database_url()
+    app.config["SQLALCHEMY_DATABASE_URI"] = url
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(url)
+
+
+def tune(engine: Engine) -> None:
+    # SQLite pragmas for every new connection. In WAL mode readers do not
+    # wait for the writer; synchronous=NORMAL syncs the WAL at checkpoints
+    # instead of at every commit, which stays consistent after a crash but
+    # may lose the last transactions on power loss.
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(connection, record) -> None:
+        cursor = connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(config.sqlite_busy_timeout)}")
+        cursor.execute(f"PRAGMA mmap_size={int(config.sqlite_mmap_size)}")
+        # Negative sizes are in KiB rather than pages
+        cursor.execute(f"PRAGMA cache_size=-{int(config.sqlite_cache_kib)}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+
+def upgrade(engine: Engine, metadata: MetaData) -> None:
+    # Brings a database created by an older version up to date: adds the
+    # missing columns and indexes. Call after db.create_all().
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table, columns in ADDED_COLUMNS.items():
+            existing = {column["name"] for column in inspector.get_columns(table)}
+            for name, ddl in columns.items():
+                if name not in existing:
+                    connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
@@ -0,0 +1,36 @@
+from typing import Tuple
+
+from sqlalchemy.orm import selectinload
+
+from .models import Company, Department, Project, Task
+
+
+# Named eager-loading profiles: the relationships each page reads while it
+# renders. selectinload fetches a relationship for all rows in one extra
+# query, so a page costs the same number of queries for 10 rows or 10,000.
+PROFILES = {
+    # tasks.html lists the assignees of every card
+    "task_board": (
+        selectinload(Task.employees),
+    ),
+    # serialize_task() reads plain columns only
+    "calendar": (),
+    # company.html walks departments, projects and their members
+    "company_page": (
+        selectinload(Company.departments).selectinload(Department.employees),
+        selectinload(Company.projects).selectinload(Project.employees),
+        selectinload(Company.employees),
+    ),
+    "department_list": (
+        selectinload(Department.employees),
+    ),
+    "project_list": (
+        selectinload(Project.employees),
+    ),
+    # employees.html reads plain columns only
+    "employee_list": (),
+}
+
+
+def profile(name: str) -> Tuple:
+    return PROFILES[name]
@@ -0,0 +1,153 @@
+import logging
+import time
+from concurrent.futures import Future
+from datetime import datetime
+from queue import Empty, Queue
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import insert
+
+from .models import db, Message
+
+
+logger = logging.getLogger(__name__)
+
+# Durability modes: "commit" answers the sender after its batch is committed,
+# "queued" answers as soon as the message is queued, so a crash can lose the
+# messages of the batch in flight
+DURABILITY_MODES = ("commit", "queued")
+
+Written = Callable[[List[Dict[str, Any]]], None]
+Pending = Tuple[Dict[str, Any], str, Future]
+
+
+class MessageWriter:
+    # Group commit for chat messages. Messages that arrive within max_delay
+    # seconds of the first one, up to max_batch of them, are inserted in one
+    # transaction, so a burst costs one commit (one fsync on SQLite) per batch
+    # instead of one per message. on_written gets the stored messages of each
+    # batch, in order, from the writer thread.
+
+    def __init__(
+        self,
+        app,
+        max_batch: int,
+        max_delay: float,
+        durability: str,
+        on_written: Optional[Written] = None,
+    ) -> None:
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"unknown durability mode {durability!r}")
+        self.app = app
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.durability = durability
+        self.on_written = on_written
+        self._queue: "Queue[Optional[Pending]]" = Queue()
+        self._thread: Optional[Thread] = None
+        self._lock = Lock()
+        self.batches = 0
+        self.messages = 0
+
+    def write(
+        self,
+        chat_id: int,
+        sender_id: int,
+        sender_name: str,
+        content: str,
+    ) -> Optional[Dict[str, Any]]:
+        # The stored message, or None in "queued" mode where it is not
+        # stored yet; either way members get it through on_written
+        self._start()
+        now = datetime.utcnow()
+        row = {
+            "content": content,
+            "timestamp": now,
+            "chat_id": chat_id,
+            "sender_id": sender_id,
+            "created_at": now,
+            "updated_at": now,
+        }
+        future: Future = Future()
+        self._queue.put((row, sender_name, future))
+        if self.durability == "queued":
+            return None
+        return future.result()
+
+    def close(self) -> None:
+        # Writes what is queued and stops the writer thread
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "messages": self.messages,
+            "mean_batch": self.messages / self.batches if self.batches else 0.0,
+            "queued": self._queue.qsize(),
+        }
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name="message-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            stop = False
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    pending = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except Empty:
+                    break
+                if pending is None:
+                    stop = True
+                    break
+                batch.append(pending)
+            self._commit(batch)
+            if stop:
+                return
+
+    def _commit(self, batch: List[Pending]) -> None:
+        try:
+            with self.app.app_context():
+                ids = db.session.scalars(
+                    insert(Message).returning(Message.id, sort_by_parameter_order=True),
+                    [row for row, _, _ in batch],
+                ).all()
+                db.session.commit()
+        except Exception as error:
+            logger.exception("Failed to write %d chat messages", len(batch))
+            for _, _, future in batch:
+                future.set_exception(error)
+            return
+        self.batches += 1
+        self.messages += len(batch)
+        written = [
+            {
+                "id": message_id,
+                "content": row["content"],
+                "timestamp": row["timestamp"].isoformat(),
+                "chat_id": row["chat_id"],
+                "sender_id": row["sender_id"],
+                "sender_name": sender_name,
+            }
+            for message_id, (row, sender_name, _) in zip(ids, batch)
+        ]
+        if self.on_written is not None:
+            try:
+                self.on_written(written)
+            except Exception:
+                logger.exception("Chat message fan-out failed")
+        for message, (_, _, future) in zip(written, batch):
+            future.set_result(message)
@@ -0,0 +1,131 @@
+import time
+from collections import deque
+from threading import Lock
+from typing import Any, Deque, Dict, List, Optional
+
+
+# Calls kept for percentiles and the recent calls list
+RECENT_CALLS = 1000
+
+
+def _percentile(values: List[float], share: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+class _Totals:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.cached = 0
+        self.rejected = 0
+        self.estimated = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.max_prompt_tokens = 0
+        self.latency = 0.0
+        self.queue_wait = 0.0
+
+    def add(self, call: Dict[str, Any]) -> None:
+        self.calls += 1
+        self.errors += call["outcome"] == "error"
+        self.cached += call["outcome"] == "cached"
+        self.rejected += call["outcome"] == "rejected"
+        self.estimated += call["estimated"]
+        self.prompt_tokens += call["prompt_tokens"]
+        self.completion_tokens += call["completion_tokens"]
+        self.max_prompt_tokens = max(self.max_prompt_tokens, call["prompt_tokens"])
+        self.latency += call["latency"]
+        self.queue_wait += call["queue_wait"]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "cached": self.cached,
+            "rejected": self.rejected,
+            "estimated_usage": self.estimated,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "max_prompt_tokens": self.max_prompt_tokens,
+            "mean_latency": self.latency / self.calls if self.calls else None,
+            "mean_queue_wait": self.queue_wait / self.calls if self.calls else None,
+        }
+
+
+class AssistantMetrics:
+    # Per-call records of assistant questions: token counts, queue wait, time
+    # to first token, total latency and model. Totals are kept per user and
+    # per company; percentiles come from the most recent calls. stats() is
+    # scoped to one company: its totals and percentiles, plus the user's own
+    # totals and calls. Other tenants' figures are never included.
+
+    def __init__(self) -> None:
+        self._users: Dict[int, _Totals] = {}
+        self._companies: Dict[int, _Totals] = {}
+        self._recent: Deque[Dict[str, Any]] = deque(maxlen=RECENT_CALLS)
+        self._lock = Lock()
+
+    def record(
+        self,
+        user_id: int,
+        company_id: int,
+        outcome: str,
+        model: Optional[str] = None,
+        backend: Optional[str] = None,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        estimated: bool = False,
+        queue_wait: float = 0.0,
+        first_token: Optional[float] = None,
+        latency: float = 0.0,
+    ) -> None:
+        call = {
+            "time": time.time(),
+            "user_id": user_id,
+            "company_id": company_id,
+            "outcome": outcome,
+            "model": model,
+            "backend": backend,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "estimated": estimated,
+            "queue_wait": queue_wait,
+            "first_token": first_token,
+            "latency": latency,
+        }
+        with self._lock:
+            self._users.setdefault(user_id, _Totals()).add(call)
+            self._companies.setdefault(company_id, _Totals()).add(call)
+            self._recent.append(call)
+
+    def stats(self, user_id: int, company_id: int, recent: int = 20) -> Dict[str, Any]:
+        with self._lock:
+            calls = [
+                call for call in self._recent
+                if call["company_id"] == company_id and call["outcome"] == "ok"
+            ]
+            latencies = [call["latency"] for call in calls]
+            first_tokens = [call["first_token"] for call in calls if call["first_token"] is not None]
+            waits = [call["queue_wait"] for call in calls]
+            prompts = [call["prompt_tokens"] for call in calls]
+            return {
+                "company": self._companies.get(company_id, _Totals()).to_dict(),
+                "percentiles": {
+                    name: {
+                        "p50": _percentile(values, 0.50),
+                        "p95": _percentile(values, 0.95),
+                        "p99": _percentile(values, 0.99),
+                    }
+                    for name, values in (
+                        ("latency", latencies),
+                        ("first_token", first_tokens),
+                        ("queue_wait", waits),
+                        ("prompt_tokens", prompts),
+                    )
+                },
+                "user": self._users.get(user_id, _Totals()).to_dict(),
+                "recent": [call for call in self._recent if call["user_id"] == user_id][-recent:],
+            }
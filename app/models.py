@@ -248,7 +248,7 @@ class Project(TimestampMixin, db.Model):
     description = db.Column(db.Text, nullable=True)
     status = db.Column(db.Enum(Status), default=Status.IN_PROGRESS, nullable=False)
 
-    company_id = db.Column(db.Integer, db.ForeignKey("company.id"), nullable=False)
+    company_id = db.Column(db.Integer, db.ForeignKey("company.id"), index=True, nullable=False)
     responsible_dept_id = db.Column(
         db.Integer, db.ForeignKey("department.id"), nullable=True
     )
@@ -293,12 +293,22 @@ class Task(TimestampMixin, db.Model):
 
     project_id = db.Column(db.Integer, db.ForeignKey("project.id"), nullable=True)
 
+    # Bumped by every update; an update made from an older version fails
+    version = db.Column(db.Integer, default=1, nullable=False)
+
     project = db.relationship("Project", back_populates="tasks")
     employees = db.relationship(
         "Employee", secondary=task_employee, back_populates="tasks"
     )
 
-    __table_args__ = (db.Index("ix_task_status_due", "status", "due_date"),)
+    __table_args__ = (
+        db.Index("ix_task_status_due", "status", "due_date"),
+        # Calendar windows, per project: due_date >= window start seeks past
+        # the project's finished tasks, start_date <= window end is checked
+        # on the rest
+        db.Index("ix_task_project_due", "project_id", "due_date", "start_date"),
+    )
+    __mapper_args__ = {"version_id_col": version}
 
     @property
     def index(self) -> str:
@@ -363,6 +373,9 @@ class HREvent(TimestampMixin, db.Model):
         "Employee", secondary=event_attendee, back_populates="events"
     )
 
+    # Calendar windows: ends_at >= window start skips the past events
+    __table_args__ = (db.Index("ix_hr_event_end", "ends_at", "starts_at"),)
+
 
 class Message(TimestampMixin, db.Model):
     __tablename__ = "message"
@@ -377,6 +390,47 @@ class Message(TimestampMixin, db.Model):
     chat = db.relationship("Chat", back_populates="messages")
     sender = db.relationship("Employee", back_populates="sent_messages")
 
+    # Chat history is read newest first, one page at a time
+    __table_args__ = (db.Index("ix_message_chat_time", "chat_id", "timestamp", "id"),)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "content": self.content,
+            "timestamp": self.timestamp.isoformat(),
+            "chat_id": self.chat_id,
+            "sender_id": self.sender_id,
+            "sender_name": self.sender.full_name if self.sender else None,
+        }
+
+
+class AssistantMessage(TimestampMixin, db.Model):
+    __tablename__ = "assistant_message"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    role = db.Column(db.String(20), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+
+    __table_args__ = (db.Index("ix_assistant_message_user", "user_id", "id"),)
+
+    def to_dict(self):
+        return {"role": self.role, "content": self.content}
+
+
+class TaskChange(db.Model):
+    # Append-only log of task inserts, updates and deletes; its id is the
+    # change cursor kanban clients sync from (see app/board.py)
+    __tablename__ = "task_change"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    task_id = db.Column(db.Integer, nullable=False)
+    project_id = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(
+        db.DateTime(timezone=True), default=datetime.utcnow, nullable=False
+    )
+
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
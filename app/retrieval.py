@@ -0,0 +1,391 @@
+import hashlib
+import math
+import os
+import pickle
+import re
+import tempfile
+from collections import Counter
+from threading import Lock, Timer
+from typing import Dict, List, Optional, Set, Tuple, Type
+
+from sqlalchemy.orm import joinedload, selectinload
+
+from .changes import Changes
+from .models import (
+    Department,
+    Employee,
+    KBRecord,
+    KnowledgeBase,
+    Project,
+    Task,
+)
+
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+# Longer words are cut to this many characters, which is a crude but
+# dependency-free way to match different forms of the same Russian word
+STEM_LENGTH = 5
+
+SNIPPET_LENGTH = 400
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+Key = Tuple[str, int]
+
+
+def tokenize(text: str) -> List[str]:
+    return [token[:STEM_LENGTH] for token in TOKEN_RE.findall(text.lower())]
+
+
+def _names(employees) -> str:
+    return ", ".join(employee.full_name for employee in employees) or "-"
+
+
+def _employee_text(employee: Employee) -> str:
+    role = employee.role.name if employee.role else "-"
+    departments = ", ".join(d.name for d in employee.departments) or "-"
+    projects = ", ".join(p.name for p in employee.projects) or "-"
+    return (
+        f"Сотрудник {employee.full_name} (id {employee.id}), email {employee.email}, "
+        f"контакты: {employee.contacts or '-'}, должность: {role}, "
+        f"отделы: {departments}, проекты: {projects}"
+    )
+
+
+def _department_text(department: Department) -> str:
+    return (
+        f"Отдел {department.name} (id {department.id}): {department.description or ''}. "
+        f"Сотрудники: {_names(department.employees)}"
+    )
+
+
+def _project_text(project: Project) -> str:
+    department = project.responsible_dept.name if project.responsible_dept else "-"
+    return (
+        f"Проект {project.name} (id {project.id}), статус {project.status.value}: "
+        f"{project.description or ''}. Ответственный отдел: {department}. "
+        f"Участники: {_names(project.employees)}"
+    )
+
+
+def _task_text(task: Task) -> str:
+    project = task.project.name if task.project else "-"
+    return (
+        f"Задача {task.name} (id {task.id}), статус {task.status.value}, "
+        f"приоритет {task.priority or '-'}, сроки {task.start_date} - {task.due_date}, "
+        f"проект {project}: {task.description or ''}. Исполнители: {_names(task.employees)}"
+    )
+
+
+def _record_text(record: KBRecord) -> str:
+    return f"Запись базы знаний (важность {record.importance}): {record.content}"
+
+
+SOURCES = {
+    Employee: ("employee", _employee_text, (
+        joinedload(Employee.role),
+        selectinload(Employee.departments),
+        selectinload(Employee.projects),
+    )),
+    Department: ("department", _department_text, (
+        selectinload(Department.employees),
+    )),
+    Project: ("project", _project_text, (
+        joinedload(Project.responsible_dept),
+        selectinload(Project.employees),
+    )),
+    Task: ("task", _task_text, (
+        joinedload(Task.project),
+        selectinload(Task.employees),
+    )),
+    KBRecord: ("kb", _record_text, ()),
+}
+
+
+def _company_query(model: Type, company_id: int):
+    if model is Task:
+        return model.query.join(Project).filter(Project.company_id == company_id)
+    if model is KBRecord:
+        return model.query.join(KnowledgeBase).filter(
+            KnowledgeBase.company_id == company_id
+        )
+    return model.query.filter(model.company_id == company_id)
+
+
+def _fingerprint(company_id: int) -> str:
+    # Digest of every column of every indexed row; a mismatch with the saved
+    # index means the database was changed while this process was not
+    # watching. Counts and timestamps alone match for different databases
+    # with the same shape, e.g. two bench.generate runs with other seeds.
+    digest = hashlib.sha1()
+    for model in SOURCES:
+        rows = (
+            _company_query(model, company_id)
+            .with_entities(*model.__table__.columns)
+            .order_by(model.id)
+        )
+        for row in rows.yield_per(1000):
+            digest.update(repr(tuple(row)).encode())
+    return digest.hexdigest()
+
+
+class _CompanyIndex:
+    def __init__(self) -> None:
+        self.fingerprint: Optional[str] = None
+        # key -> (text, length, boost)
+        self.docs: Dict[Key, Tuple[str, int, float]] = {}
+        self.postings: Dict[str, Dict[Key, int]] = {}
+        self.total_length = 0
+
+    def add(self, key: Key, text: str, boost: float = 1.0) -> None:
+        self.remove(key)
+        counts = Counter(tokenize(text))
+        length = sum(counts.values())
+        self.docs[key] = (text, length, boost)
+        self.total_length += length
+        for term, count in counts.items():
+            self.postings.setdefault(term, {})[key] = count
+
+    def remove(self, key: Key) -> None:
+        doc = self.docs.pop(key, None)
+        if doc is None:
+            return
+        text, length, _ = doc
+        self.total_length -= length
+        for term in set(tokenize(text)):
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(key, None)
+            if not postings:
+                del self.postings[term]
+
+    def search(self, query: str, k: int) -> List[str]:
+        if not self.docs:
+            return []
+        size = len(self.docs)
+        average = self.total_length / size or 1
+        scores: Dict[Key, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (size - len(postings) + 0.5) / (len(postings) + 0.5))
+            for key, count in postings.items():
+                length = self.docs[key][1]
+                norm = count + K1 * (1 - B + B * length / average)
+                scores[key] = scores.get(key, 0.0) + idf * count * (K1 + 1) / norm
+        best = sorted(
+            scores, key=lambda key: scores[key] * self.docs[key][2], reverse=True
+        )[:k]
+        return [self.docs[key][0][:SNIPPET_LENGTH] for key in best]
+
+
+class RetrievalIndex:
+    # BM25 index over the company's employees, departments, projects, tasks and
+    # knowledge base records. Each company is kept in memory and pickled to
+    # its own file, in a directory of its own per database. Commits mark
+    # changed rows stale, and they are re-indexed before the company's next
+    # search, just like CompanyContextCache. Changed indexes are written to
+    # disk save_delay seconds later from a timer thread, not by searches.
+    # Loading, verifying and saving scan the company's rows in the database,
+    # so they run without the lock: searches of other companies and commit
+    # listeners are not held up by them.
+
+    def __init__(self, app, directory: str, database: str, top_k: int, save_delay: float) -> None:
+        self.app = app
+        self.directory = os.path.join(
+            directory, hashlib.sha1(database.encode()).hexdigest()[:16]
+        )
+        self.top_k = top_k
+        self.save_delay = save_delay
+        self._indexes: Dict[int, _CompanyIndex] = {}
+        # company id -> model -> ids changed since its last refresh
+        self._stale: Dict[int, Dict[Type, Set[int]]] = {}
+        # Companies changed in memory since they were last saved
+        self._unsaved: Set[int] = set()
+        self._timer: Optional[Timer] = None
+        # Companies whose index is being loaded or built right now
+        self._loading: Set[int] = set()
+        # company id -> number of commits that touched it, to tell whether a
+        # fingerprint computed without the lock still matches the index
+        self._generations: Dict[int, int] = {}
+        self._lock = Lock()
+        # Serializes loads, so a company is read from disk only once
+        self._load_lock = Lock()
+
+    def search(self, company_id: int, query: str, k: Optional[int] = None) -> List[str]:
+        # The first search of a company loads and verifies its index; callers
+        # run it on the assistant pool, not in a Socket.IO handler
+        index = self._index(company_id)
+        with self._lock:
+            stale = self._stale.pop(company_id, None)
+            if stale:
+                self._refresh(company_id, index, self._with_dependents(stale))
+                self._schedule_save(company_id)
+            return index.search(query, k or self.top_k)
+
+    def invalidate(self, changes: Changes) -> None:
+        with self._lock:
+            for model in SOURCES:
+                ids = changes.get(model)
+                if not ids:
+                    continue
+                for company_id in self._indexes.keys() | self._loading:
+                    self._stale.setdefault(company_id, {}).setdefault(model, set()).update(ids)
+                    self._generations[company_id] = self._generations.get(company_id, 0) + 1
+
+    def rebuild(self, company_id: int) -> None:
+        with self._lock:
+            generation = self._generations.get(company_id, 0)
+        fingerprint = _fingerprint(company_id)
+        index = self._build(company_id)
+        with self._lock:
+            self._indexes[company_id] = index
+            if self._generations.get(company_id, 0) != generation:
+                # Changed while building; refreshed and saved after the next search
+                self._unsaved.add(company_id)
+                return
+            self._stale.pop(company_id, None)
+            self._unsaved.discard(company_id)
+            data = self._dump(company_id, fingerprint)
+        self._write(company_id, data)
+
+    def close(self) -> None:
+        # Writes the unsaved indexes now instead of waiting for the timer
+        with self._lock:
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+        self._flush()
+
+    def _path(self, company_id: int) -> str:
+        return os.path.join(self.directory, f"company-{company_id}.pickle")
+
+    def _index(self, company_id: int) -> _CompanyIndex:
+        with self._lock:
+            index = self._indexes.get(company_id)
+        if index is not None:
+            return index
+        with self._load_lock:
+            with self._lock:
+                index = self._indexes.get(company_id)
+                if index is not None:
+                    return index
+                # Commits made while loading mark the index stale as well
+                self._loading.add(company_id)
+            try:
+                index, saved = self._load(company_id)
+            finally:
+                with self._lock:
+                    self._loading.discard(company_id)
+            with self._lock:
+                self._indexes[company_id] = index
+                if not saved:
+                    self._schedule_save(company_id)
+            return index
+
+    def _load(self, company_id: int) -> Tuple[_CompanyIndex, bool]:
+        # The saved index if it matches the database, a fresh one otherwise
+        path = self._path(company_id)
+        if os.path.exists(path):
+            with open(path, "rb") as file:
+                index = pickle.load(file)
+            if index.fingerprint == _fingerprint(company_id):
+                return index, True
+        return self._build(company_id), False
+
+    def _build(self, company_id: int) -> _CompanyIndex:
+        index = _CompanyIndex()
+        for model in SOURCES:
+            self._index_rows(index, model, _company_query(model, company_id))
+        return index
+
+    def _index_rows(self, index: _CompanyIndex, model: Type, query) -> None:
+        kind, render, options = SOURCES[model]
+        for row in query.options(*options):
+            boost = 1.0
+            if model is KBRecord:
+                # Important records win ties against ordinary entity rows
+                boost = 1.0 + row.importance / 100
+            index.add((kind, row.id), render(row), boost)
+
+    def _with_dependents(self, changed: Dict[Type, Set[int]]) -> Dict[Type, Set[int]]:
+        stale = {model: set(ids) for model, ids in changed.items()}
+        # Department and project names also appear in their members' text
+        if stale.get(Department):
+            for department in Department.query.filter(
+                Department.id.in_(stale[Department])
+            ).options(selectinload(Department.employees)):
+                stale.setdefault(Employee, set()).update(e.id for e in department.employees)
+        if stale.get(Project):
+            for project in Project.query.filter(
+                Project.id.in_(stale[Project])
+            ).options(selectinload(Project.employees), selectinload(Project.tasks)):
+                stale.setdefault(Employee, set()).update(e.id for e in project.employees)
+                stale.setdefault(Task, set()).update(t.id for t in project.tasks)
+        return stale
+
+    def _refresh(self, company_id: int, index: _CompanyIndex, stale: Dict[Type, Set[int]]) -> None:
+        for model, ids in stale.items():
+            kind = SOURCES[model][0]
+            for row_id in ids:
+                index.remove((kind, row_id))
+            query = (
+                _company_query(model, company_id)
+                .filter(model.id.in_(ids))
+                .execution_options(populate_existing=True)
+            )
+            self._index_rows(index, model, query)
+
+    def _schedule_save(self, company_id: int) -> None:
+        # Called with the lock held; changes within save_delay share one write
+        self._unsaved.add(company_id)
+        if self._timer is None:
+            self._timer = Timer(self.save_delay, self._flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush(self) -> None:
+        with self.app.app_context():
+            with self._lock:
+                self._timer = None
+                # A company changed again since its refresh is saved after
+                # the search that refreshes it
+                companies = {
+                    company_id: self._generations.get(company_id, 0)
+                    for company_id in self._unsaved
+                    if company_id not in self._stale
+                }
+            for company_id, generation in companies.items():
+                fingerprint = _fingerprint(company_id)
+                with self._lock:
+                    # Changed while the fingerprint was computed: it may not
+                    # describe the index any more
+                    if self._generations.get(company_id, 0) != generation:
+                        continue
+                    self._unsaved.discard(company_id)
+                    data = self._dump(company_id, fingerprint)
+                self._write(company_id, data)
+
+    def _dump(self, company_id: int, fingerprint: str) -> bytes:
+        # Called with the lock held, so the index does not change while pickled
+        index = self._indexes[company_id]
+        index.fingerprint = fingerprint
+        return pickle.dumps(index)
+
+    def _write(self, company_id: int, data: bytes) -> None:
+        # Worker processes sharing the directory each write their own
+        # temporary file and atomically replace the index with it
+        os.makedirs(self.directory, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                file.write(data)
+            os.replace(temporary, self._path(company_id))
+        except BaseException:
+            os.unlink(temporary)
+            raise
@@ -0,0 +1,55 @@
+from threading import Lock
+from typing import Dict, Optional, Set
+
+
+def company_room(company_id: int) -> str:
+    return f"company-{company_id}"
+
+
+def project_room(project_id: int) -> str:
+    return f"project-{project_id}"
+
+
+def chat_room(chat_id: int) -> str:
+    return f"chat-{chat_id}"
+
+
+class RoomStats:
+    # Subscribers of each Socket.IO room in this process, for metrics.
+    # Updated next to every join_room() call and on disconnect.
+
+    def __init__(self) -> None:
+        self._rooms: Dict[str, Set[str]] = {}
+        self._sids: Dict[str, Set[str]] = {}
+        self._lock = Lock()
+
+    def joined(self, sid: str, room: str) -> None:
+        with self._lock:
+            self._rooms.setdefault(room, set()).add(sid)
+            self._sids.setdefault(sid, set()).add(room)
+
+    def left(self, sid: str, room: Optional[str] = None) -> None:
+        # Without a room the sid leaves all its rooms (on disconnect)
+        with self._lock:
+            rooms = self._sids.get(sid, set())
+            for name in [room] if room else list(rooms):
+                rooms.discard(name)
+                members = self._rooms.get(name)
+                if members is not None:
+                    members.discard(sid)
+                    if not members:
+                        del self._rooms[name]
+            if not rooms:
+                self._sids.pop(sid, None)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            kinds: Dict[str, int] = {}
+            for room, members in self._rooms.items():
+                kind = room.split("-", 1)[0]
+                kinds[kind] = kinds.get(kind, 0) + len(members)
+            return {
+                "connections": len(self._sids),
+                "subscribers": kinds,
+                "rooms": {room: len(members) for room, members in sorted(self._rooms.items())},
+            }
@@ -0,0 +1,205 @@
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+
+# Searchable rows: kind -> (rowid code, table, title, body, company id, parent id).
+# The expressions are SQL over the row (NEW/OLD in triggers, the table when
+# rebuilding). The parent is the chat of a message, the project of a task
+# and the knowledge base of a record.
+SOURCES = {
+    "message": (
+        1, "message", "''", "{row}.content",
+        "(SELECT company_id FROM employee WHERE id = {row}.sender_id)", "{row}.chat_id",
+    ),
+    "task": (
+        2, "task", "{row}.name", "coalesce({row}.description, '')",
+        "(SELECT company_id FROM project WHERE id = {row}.project_id)", "{row}.project_id",
+    ),
+    "project": (
+        3, "project", "{row}.name", "coalesce({row}.description, '')",
+        "{row}.company_id", "NULL",
+    ),
+    "kb": (
+        4, "kb_record", "''", "{row}.content",
+        "(SELECT company_id FROM knowledge_base WHERE id = {row}.kb_id)", "{row}.kb_id",
+    ),
+    "employee": (
+        5, "employee",
+        "{row}.surname || ' ' || {row}.name || coalesce(' ' || {row}.patronymic, '')",
+        "{row}.email", "{row}.company_id", "NULL",
+    ),
+}
+
+# rowid = id * ROWID_KINDS + code, so every row can be found without a scan
+ROWID_KINDS = 8
+
+# bm25 weights of the title and body columns; the scope column only
+# narrows the match and does not rank
+TITLE_WEIGHT = 10.0
+BODY_WEIGHT = 1.0
+SCOPE_WEIGHT = 0.0
+
+SNIPPET_TOKENS = 16
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Who may see a row is an indexed token: "c42" for the rows of company 42,
+# "m42x7" for messages of chat 7 sent by its employees. MATCH then walks
+# only the postings of the company and of the user's chats, instead of
+# ranking every tenant's rows and filtering them afterwards.
+CREATE_TABLE = """
+CREATE VIRTUAL TABLE search_index USING fts5(
+    title, body, scope,
+    kind UNINDEXED, row_id UNINDEXED, parent_id UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+)
+"""
+
+
+COLUMNS = "rowid, title, body, scope, kind, row_id, parent_id"
+
+
+def _scope(kind: str, row: str) -> str:
+    _, _, _, _, company, parent = SOURCES[kind]
+    if kind == "message":
+        return f"'m' || {company.format(row=row)} || 'x' || {parent.format(row=row)}"
+    return f"'c' || {company.format(row=row)}"
+
+
+def _values(kind: str, row: str) -> str:
+    code, _, title, body, _, parent = SOURCES[kind]
+    return ", ".join([
+        f"{row}.id * {ROWID_KINDS} + {code}",
+        title.format(row=row),
+        body.format(row=row),
+        _scope(kind, row),
+        f"'{kind}'",
+        f"{row}.id",
+        parent.format(row=row),
+    ])
+
+
+def _triggers(kind: str) -> Dict[str, str]:
+    code, table = SOURCES[kind][:2]
+    insert = (
+        f"INSERT INTO search_index({COLUMNS}) VALUES ({_values(kind, 'NEW')});"
+    )
+    delete = f"DELETE FROM search_index WHERE rowid = OLD.id * {ROWID_KINDS} + {code};"
+    return {
+        f"search_{table}_insert": f"AFTER INSERT ON {table} BEGIN {insert} END",
+        f"search_{table}_update": f"AFTER UPDATE ON {table} BEGIN {delete} {insert} END",
+        f"search_{table}_delete": f"AFTER DELETE ON {table} BEGIN {delete} END",
+    }
+
+
+TRIGGERS = {name: sql for kind in SOURCES for name, sql in _triggers(kind).items()}
+
+
+def supported(engine: Engine) -> bool:
+    return engine.dialect.name == "sqlite"
+
+
+def install(engine: Engine) -> None:
+    # Creates the index and its triggers. A missing trigger means the source
+    # tables were recreated (e.g. by the seeder), so the index is rebuilt.
+    # An index of an older layout (company_id UNINDEXED) is replaced.
+    if not supported(engine):
+        return
+    with engine.begin() as connection:
+        existing = {
+            name for name, in connection.execute(text(
+                "SELECT name FROM sqlite_master WHERE name = 'search_index' OR type = 'trigger'"
+            ))
+        }
+        if "search_index" in existing:
+            columns = {row.name for row in connection.execute(text("PRAGMA table_info(search_index)"))}
+            if "scope" not in columns:
+                for name in TRIGGERS:
+                    connection.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+                connection.execute(text("DROP TABLE search_index"))
+                existing = set()
+        if "search_index" not in existing:
+            connection.execute(text(CREATE_TABLE))
+        missing = [name for name in TRIGGERS if name not in existing]
+        for name in missing:
+            connection.execute(text(f"CREATE TRIGGER {name} {TRIGGERS[name]}"))
+    if missing:
+        rebuild(engine)
+
+
+def rebuild(engine: Engine) -> int:
+    # Refills the index from the source tables; returns the number of rows
+    with engine.begin() as connection:
+        connection.execute(text("DELETE FROM search_index"))
+        for kind, (_, table, *_) in SOURCES.items():
+            connection.execute(text(
+                f"INSERT INTO search_index({COLUMNS}) SELECT {_values(kind, table)} FROM {table}"
+            ))
+        connection.execute(text("INSERT INTO search_index(search_index) VALUES ('optimize')"))
+        return connection.execute(text("SELECT count(*) FROM search_index")).scalar()
+
+
+def match_query(query: str, company_id: int, chat_ids: Sequence[int] = ()) -> Optional[str]:
+    # Every word must match the title or body, the last one as a prefix
+    # since it may still be being typed, within the company's rows and the
+    # messages of the given chats. Quoting keeps FTS5 operators in user
+    # input from applying.
+    words = WORD_RE.findall(query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    scopes = [f"c{int(company_id)}"] + [f"m{int(company_id)}x{int(chat_id)}" for chat_id in chat_ids]
+    return f"scope : ({' OR '.join(scopes)}) AND {{title body}} : ({' '.join(terms)})"
+
+
+def search(
+    engine: Engine,
+    company_id: int,
+    query: str,
+    employee_id: Optional[int] = None,
+    kinds: Optional[Sequence[str]] = None,
+    limit: int = 20,
+) -> List[Dict[str, Any]]:
+    # Ranked matches within one company. Messages are only returned from
+    # chats the employee is a member of.
+    conditions = ["search_index MATCH :match"]
+    params: Dict[str, Any] = {"limit": limit}
+    if kinds:
+        names = [kind for kind in kinds if kind in SOURCES]
+        if not names:
+            return []
+        conditions.append("kind IN (" + ", ".join(f"'{kind}'" for kind in names) + ")")
+    with engine.connect() as connection:
+        chat_ids: Sequence[int] = ()
+        if employee_id is not None and (not kinds or "message" in kinds):
+            chat_ids = connection.execute(
+                text("SELECT chat_id FROM chat_employee WHERE employee_id = :employee_id"),
+                {"employee_id": employee_id},
+            ).scalars().all()
+        match = match_query(query, company_id, chat_ids)
+        if match is None:
+            return []
+        params["match"] = match
+        sql = (
+            "SELECT kind, row_id, parent_id, title, "
+            f"snippet(search_index, 1, '', '', '…', {SNIPPET_TOKENS}) AS snippet, "
+            f"bm25(search_index, {TITLE_WEIGHT}, {BODY_WEIGHT}, {SCOPE_WEIGHT}) AS score "
+            "FROM search_index WHERE " + " AND ".join(conditions) +
+            " ORDER BY score LIMIT :limit"
+        )
+        return [
+            {
+                "kind": row.kind,
+                "id": row.row_id,
+                "parent_id": row.parent_id,
+                "title": row.title,
+                "snippet": row.snippet,
+                "score": -row.score,
+            }
+            for row in connection.execute(text(sql), params)
+        ]
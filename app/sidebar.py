@@ -0,0 +1,96 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import List
+
+from sqlalchemy import func
+
+from .changes import Changes
+from .models import Chat, Employee, Message, chat_employee
+
+
+class SidebarChat:
+    # The chat fields base.html reads, kept apart from the session so
+    # cached entries can be shared between requests and threads
+
+    def __init__(self, chat_id: int, name: str) -> None:
+        self.id = chat_id
+        self.name = name
+
+    @property
+    def index(self) -> str:
+        return "".join(i[0] for i in self.name.title().split()) + '-' + str(self.id)
+
+
+class SidebarChats:
+    # The sidebar chat list of each user: only the chats the user's employee
+    # is a member of, most recently active first, at most max_chats of them.
+    # Lists are cached per user; a new message moves its chat to the top of
+    # the cached lists, and chat or membership changes drop them.
+
+    def __init__(self, max_chats: int, max_users: int) -> None:
+        self.max_chats = max_chats
+        self.max_users = max_users
+        # user_id -> (employee_id or None, chats)
+        self._cache: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = Lock()
+
+    def chats(self, user_id: int) -> List[SidebarChat]:
+        with self._lock:
+            entry = self._cache.get(user_id)
+            if entry is not None:
+                self._cache.move_to_end(user_id)
+                return list(entry[1])
+        employee_id = Employee.query.filter(
+            Employee.user_id == user_id
+        ).with_entities(Employee.id).scalar()
+        chats = self._load(employee_id) if employee_id is not None else []
+        with self._lock:
+            self._cache[user_id] = (employee_id, chats)
+            while len(self._cache) > self.max_users:
+                self._cache.popitem(last=False)
+        return list(chats)
+
+    def touch(self, chat_id: int) -> None:
+        # Called after a message is sent to the chat. A full list without
+        # the chat may be missing it only because it was below the cut, so
+        # that user's list is dropped and reloaded on the next request;
+        # shorter lists hold all of the user's chats.
+        with self._lock:
+            for user_id, (_, chats) in list(self._cache.items()):
+                for position, chat in enumerate(chats):
+                    if chat.id == chat_id:
+                        chats.insert(0, chats.pop(position))
+                        break
+                else:
+                    if len(chats) >= self.max_chats:
+                        del self._cache[user_id]
+
+    def invalidate(self, changes: Changes) -> None:
+        with self._lock:
+            # New, renamed or deleted chats may belong to anyone
+            if changes.get(Chat):
+                self._cache.clear()
+                return
+            employees = changes.get(Employee)
+            if not employees:
+                return
+            for user_id, (employee_id, _) in list(self._cache.items()):
+                if employee_id in employees:
+                    del self._cache[user_id]
+
+    def _load(self, employee_id: int) -> List[SidebarChat]:
+        last_message = (
+            Message.query
+            .filter(Message.chat_id == Chat.id)
+            .with_entities(func.max(Message.timestamp))
+            .scalar_subquery()
+        )
+        rows = (
+            Chat.query
+            .join(chat_employee, chat_employee.c.chat_id == Chat.id)
+            .filter(chat_employee.c.employee_id == employee_id)
+            .with_entities(Chat.id, Chat.name)
+            .order_by(func.coalesce(last_message, Chat.created_at).desc(), Chat.id.desc())
+            .limit(self.max_chats)
+        )
+        return [SidebarChat(chat_id, name) for chat_id, name in rows]
@@ -0,0 +1,271 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+Subscriber = Callable[[Any], None]
+
+
+class Store(ABC):
+    # State shared by all worker processes: JSON values with an optional
+    # time to live, and publish/subscribe channels. publish() reaches every
+    # subscriber, including those of the publishing process.
+
+    @abstractmethod
+    def get(self, key: str) -> Any:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        pass
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        pass
+
+    @abstractmethod
+    def incr(self, key: str) -> int:
+        pass
+
+    @abstractmethod
+    def publish(self, channel: str, message: Any) -> None:
+        pass
+
+    @abstractmethod
+    def subscribe(self, channel: str, callback: Subscriber) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def _deliver(callbacks: List[Subscriber], message: Any) -> None:
+    for callback in callbacks:
+        try:
+            callback(message)
+        except Exception:
+            logger.exception("Store subscriber failed")
+
+
+class MemoryStore(Store):
+    # Everything in this process: the default for a single worker. Values
+    # are evicted least recently used first beyond max_entries.
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        # key -> (expiry time or None, value)
+        self._values: "OrderedDict[str, tuple]" = OrderedDict()
+        self._subscribers: Dict[str, List[Subscriber]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            if entry[0] is not None and entry[0] < time.monotonic():
+                del self._values[key]
+                return None
+            self._values.move_to_end(key)
+            # A copy, as a shared backend would return
+            return json.loads(json.dumps(entry[1]))
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        expiry = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._values[key] = (expiry, json.loads(json.dumps(value)))
+            self._values.move_to_end(key)
+            while len(self._values) > self.max_entries:
+                self._values.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._values.pop(key, None)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            expiry, value = self._values.get(key, (None, 0))
+            self._values[key] = (expiry, value + 1)
+            return value + 1
+
+    def publish(self, channel: str, message: Any) -> None:
+        with self._lock:
+            callbacks = list(self._subscribers.get(channel, ()))
+        _deliver(callbacks, message)
+
+    def subscribe(self, channel: str, callback: Subscriber) -> None:
+        with self._lock:
+            self._subscribers.setdefault(channel, []).append(callback)
+
+
+class SQLiteStore(Store):
+    # A database file shared by the worker processes of one host; needs no
+    # extra service, so it stands in for Redis on a single machine.
+    # Subscribers poll the message table every poll_interval seconds.
+
+    # Published messages are kept this many seconds for slow pollers, and
+    # expired values are removed once every PRUNE_EVERY writes
+    MESSAGE_TTL = 60
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path: str, poll_interval: float = 0.1) -> None:
+        self.path = path
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        self._subscribers: Dict[str, List[Subscriber]] = {}
+        self._lock = threading.Lock()
+        self._poller: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._writes = 0
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS store_value "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS store_message (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "channel TEXT NOT NULL, message TEXT NOT NULL, created REAL NOT NULL)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key: str) -> Any:
+        row = self._connection().execute(
+            "SELECT value FROM store_value WHERE key = ? AND (expires IS NULL OR expires > ?)",
+            (key, time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        connection = self._connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO store_value (key, value, expires) VALUES (?, ?, ?)",
+            (key, json.dumps(value), now + ttl if ttl else None),
+        )
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            connection.execute("DELETE FROM store_value WHERE expires < ?", (now,))
+
+    def delete(self, key: str) -> None:
+        self._connection().execute("DELETE FROM store_value WHERE key = ?", (key,))
+
+    def incr(self, key: str) -> int:
+        return self._connection().execute(
+            "INSERT INTO store_value (key, value) VALUES (?, '1') "
+            "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1 "
+            "RETURNING CAST(value AS INTEGER)",
+            (key,),
+        ).fetchone()[0]
+
+    def publish(self, channel: str, message: Any) -> None:
+        now = time.time()
+        connection = self._connection()
+        connection.execute(
+            "INSERT INTO store_message (channel, message, created) VALUES (?, ?, ?)",
+            (channel, json.dumps(message), now),
+        )
+        connection.execute(
+            "DELETE FROM store_message WHERE created < ?", (now - self.MESSAGE_TTL,)
+        )
+
+    def subscribe(self, channel: str, callback: Subscriber) -> None:
+        with self._lock:
+            self._subscribers.setdefault(channel, []).append(callback)
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll, name="store-poller", daemon=True)
+                self._poller.start()
+
+    def close(self) -> None:
+        self._stopped.set()
+        if self._poller is not None:
+            self._poller.join()
+
+    def _poll(self) -> None:
+        connection = self._connection()
+        # Only messages published after subscribing are delivered
+        last = connection.execute("SELECT coalesce(max(id), 0) FROM store_message").fetchone()[0]
+        while not self._stopped.wait(self.poll_interval):
+            try:
+                rows = connection.execute(
+                    "SELECT id, channel, message FROM store_message WHERE id > ? ORDER BY id",
+                    (last,),
+                ).fetchall()
+            except sqlite3.Error:
+                logger.exception("Failed to poll the store for messages")
+                continue
+            for message_id, channel, message in rows:
+                last = message_id
+                with self._lock:
+                    callbacks = list(self._subscribers.get(channel, ()))
+                _deliver(callbacks, json.loads(message))
+
+
+class RedisStore(Store):
+    # Redis (or anything speaking its protocol) shared by workers on any
+    # number of hosts. Needs the redis package.
+
+    def __init__(self, url: str) -> None:
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self._pubsub = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        value = self.client.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.client.set(key, json.dumps(value), px=int(ttl * 1000) if ttl else None)
+
+    def delete(self, key: str) -> None:
+        self.client.delete(key)
+
+    def incr(self, key: str) -> int:
+        return self.client.incr(key)
+
+    def publish(self, channel: str, message: Any) -> None:
+        self.client.publish(channel, json.dumps(message))
+
+    def subscribe(self, channel: str, callback: Subscriber) -> None:
+        def handler(message: Dict[str, Any]) -> None:
+            _deliver([callback], json.loads(message["data"]))
+
+        with self._lock:
+            if self._pubsub is None:
+                self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            self._pubsub.subscribe(**{channel: handler})
+            if self._thread is None:
+                self._thread = self._pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def close(self) -> None:
+        if self._thread is not None:
+            self._thread.stop()
+        self.client.close()
+
+
+def create_store(url: str, max_entries: int = 10000) -> Store:
+    # memory://, sqlite:///path/to/file.db or redis://host:port/db
+    if url == "memory://":
+        return MemoryStore(max_entries)
+    if url.startswith("sqlite:///"):
+        return SQLiteStore(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStore(url)
+    raise ValueError(f"unsupported store URL {url!r}")
@@ -0,0 +1,186 @@
+import logging
+import time
+from concurrent.futures import Future
+from queue import Empty, Queue
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm.exc import StaleDataError
+
+from .models import db, Project, Status, Task
+
+
+logger = logging.getLogger(__name__)
+
+# (task id, new status, version the client last saw)
+Move = Tuple[int, str, int]
+Moved = Callable[[List[Dict[str, Any]]], None]
+
+
+class _Request:
+    def __init__(self, sid: str, company_id: int, moves: List[Move]) -> None:
+        self.sid = sid
+        self.company_id = company_id
+        self.moves = moves
+        self.future: Future = Future()
+
+
+class TaskMoves:
+    # Kanban moves with optimistic concurrency. Moves that arrive within
+    # `window` seconds are applied together with one commit. A move must name
+    # the version of the task it was made from; the first client to move a
+    # version wins and later moves from other clients are rejected with the
+    # current state. Repeated moves of one task by the same client in the
+    # window collapse into a single update of its final column.
+
+    def __init__(self, app, window: float, on_moved: Optional[Moved] = None) -> None:
+        self.app = app
+        self.window = window
+        self.on_moved = on_moved
+        self._queue: "Queue[Optional[_Request]]" = Queue()
+        self._thread: Optional[Thread] = None
+        self._lock = Lock()
+        self.batches = 0
+        self.moves = 0
+        self.updates = 0
+        self.conflicts = 0
+
+    def move(self, sid: str, company_id: int, moves: List[Move]) -> List[Dict[str, Any]]:
+        # One result per move, in order, once the window is committed
+        self._start()
+        request = _Request(sid, company_id, moves)
+        self._queue.put(request)
+        return request.future.result()
+
+    def close(self) -> None:
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "batches": self.batches,
+            "moves": self.moves,
+            "updates": self.updates,
+            "conflicts": self.conflicts,
+        }
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name="task-moves", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            stop = False
+            deadline = time.monotonic() + self.window
+            while True:
+                try:
+                    request = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except Empty:
+                    break
+                if request is None:
+                    stop = True
+                    break
+                batch.append(request)
+            try:
+                with self.app.app_context():
+                    self._apply(batch)
+            except Exception as error:
+                logger.exception("Failed to apply %d task moves", len(batch))
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(error)
+            if stop:
+                return
+
+    def _apply(self, batch: List[_Request]) -> None:
+        ids = {task_id for request in batch for task_id, _, _ in request.moves}
+        tasks = {
+            task.id: (task, project_company)
+            for task, project_company in Task.query.outerjoin(Project)
+            .filter(Task.id.in_(ids))
+            .with_entities(Task, Project.company_id)
+        }
+        base = {task_id: task.version for task_id, (task, _) in tasks.items()}
+        # task id -> sid of the client whose moves were accepted
+        owners: Dict[int, str] = {}
+        # (task id, accepted) for each move of each request, answered after the commit
+        outcomes: List[List[Tuple[int, bool]]] = []
+        for request in batch:
+            results = []
+            for task_id, status, version in request.moves:
+                entry = tasks.get(task_id)
+                accepted = (
+                    entry is not None
+                    and entry[1] == request.company_id
+                    and version == base[task_id]
+                    and owners.setdefault(task_id, request.sid) == request.sid
+                )
+                if accepted:
+                    entry[0].status = Status(status)
+                results.append((task_id, accepted))
+            outcomes.append(results)
+        changed = {task.id for task, _ in tasks.values() if db.session.is_modified(task)}
+        # Final column and version of every task, known before the commit
+        # expires the loaded rows
+        final = {
+            task_id: (task.status.value, base[task_id] + (task_id in changed))
+            for task_id, (task, _) in tasks.items()
+        }
+        projects = {task_id: task.project_id for task_id, (task, _) in tasks.items()}
+        try:
+            db.session.commit()
+        except StaleDataError:
+            # Another process moved one of the tasks first; nothing was saved
+            db.session.rollback()
+            owners.clear()
+            changed = set()
+            final = {
+                task_id: (status.value, version)
+                for task_id, status, version in Task.query.filter(Task.id.in_(ids))
+                .with_entities(Task.id, Task.status, Task.version)
+            }
+        # company_id and project_id tell the listener which boards to notify
+        moved = [
+            {
+                "task_id": task_id,
+                "new_status": final[task_id][0],
+                "version": final[task_id][1],
+                "company_id": tasks[task_id][1],
+                "project_id": projects[task_id],
+            }
+            for task_id in sorted(changed)
+        ]
+        self.batches += 1
+        self.updates += len(moved)
+        if moved and self.on_moved is not None:
+            try:
+                self.on_moved(moved)
+            except Exception:
+                logger.exception("Task move fan-out failed")
+        for request, results in zip(batch, outcomes):
+            answers = []
+            for task_id, accepted in results:
+                entry = tasks.get(task_id)
+                if entry is None or entry[1] != request.company_id or task_id not in final:
+                    answers.append({"task_id": task_id, "ok": False, "error": "not found"})
+                    continue
+                ok = accepted and owners.get(task_id) == request.sid
+                self.moves += 1
+                self.conflicts += not ok
+                answers.append({
+                    "task_id": task_id,
+                    "ok": ok,
+                    "conflict": not ok,
+                    "status": final[task_id][0],
+                    "version": final[task_id][1],
+                })
+            request.future.set_result(answers)
@@ -0,0 +1,276 @@
+import json
+import logging
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import joinedload, selectinload
+
+from .models import Department, Employee, Project, Status, Task, db
+
+
+logger = logging.getLogger(__name__)
+
+
+# Upper bound on rows a single tool call returns to the model
+MAX_ROWS = 25
+
+
+def _employee_row(employee: Employee) -> Dict[str, Any]:
+    return {
+        "id": employee.id,
+        "full_name": employee.full_name,
+        "email": employee.email,
+        "contacts": employee.contacts,
+        "role": employee.role.name if employee.role else None,
+    }
+
+
+def _task_row(task: Task) -> Dict[str, Any]:
+    return {
+        "id": task.id,
+        "name": task.name,
+        "status": task.status.value,
+        "priority": task.priority,
+        "start_date": task.start_date.isoformat() if task.start_date else None,
+        "due_date": task.due_date.isoformat() if task.due_date else None,
+        "project": task.project.name if task.project else None,
+        "employees": [employee.full_name for employee in task.employees],
+    }
+
+
+def _prefix(column, word: str):
+    # A range instead of LIKE so the b-tree index on the column is used.
+    # Names are stored capitalized, so the search word is capitalized too.
+    word = word.capitalize()
+    return and_(column >= word, column < word[:-1] + chr(ord(word[-1]) + 1))
+
+
+def _starts_with(model, company_id: int, prefix: str) -> List[int]:
+    # Ids of the company's rows whose name starts with the prefix, in name
+    # order. SQLite's LIKE and lower() fold only ASCII, so "проект" would not
+    # find "Проект"; the names are folded with casefold() here instead. Only
+    # id and name of one company's projects or departments are read.
+    folded = prefix.strip().casefold()
+    rows = db.session.execute(
+        db.select(model.id, model.name)
+        .where(model.company_id == company_id)
+        .order_by(model.name)
+    )
+    return [row.id for row in rows if row.name.casefold().startswith(folded)]
+
+
+def _check_arguments(parameters: Dict[str, Any], arguments: Any) -> None:
+    # The model's arguments are checked against the tool's JSON schema so a
+    # wrong type comes back as a readable error instead of failing in a query
+    if not isinstance(arguments, dict):
+        raise ValueError("arguments must be a JSON object")
+    properties = parameters.get("properties", {})
+    for name in parameters.get("required", []):
+        if arguments.get(name) is None:
+            raise ValueError(f"missing required argument {name}")
+    for name, value in arguments.items():
+        if name not in properties:
+            raise ValueError(f"unknown argument {name}")
+        if value is None:
+            continue
+        if not isinstance(value, str):
+            raise ValueError(f"argument {name} must be a string")
+        if "enum" in properties[name] and value not in properties[name]["enum"]:
+            raise ValueError(f"argument {name} must be one of {', '.join(properties[name]['enum'])}")
+
+
+def _parse_date(value: Optional[str]) -> Optional[date]:
+    return date.fromisoformat(value) if value else None
+
+
+class CompanyTools:
+    # Query functions the model can call to fetch company data on demand.
+    # Every query is limited to one company and to MAX_ROWS rows.
+
+    SCHEMAS = [
+        {
+            "type": "function",
+            "function": {
+                "name": "find_employees",
+                "description": "Найти сотрудников по фамилии и/или имени (можно начало слова).",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "name": {"type": "string", "description": "Фамилия, имя или 'Фамилия Имя'"},
+                    },
+                    "required": ["name"],
+                },
+            },
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "project_members",
+                "description": "Участники проекта, его статус и ответственный отдел.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "project": {"type": "string", "description": "Название проекта"},
+                    },
+                    "required": ["project"],
+                },
+            },
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "find_tasks",
+                "description": "Задачи компании по статусу и сроку сдачи.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "status": {
+                            "type": "string",
+                            "enum": [status.value for status in Status],
+                        },
+                        "due_after": {"type": "string", "description": "YYYY-MM-DD"},
+                        "due_before": {"type": "string", "description": "YYYY-MM-DD"},
+                        "project": {"type": "string", "description": "Название проекта"},
+                    },
+                },
+            },
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "department_roster",
+                "description": "Сотрудники отдела и проекты, за которые он отвечает.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "department": {"type": "string", "description": "Название отдела"},
+                    },
+                    "required": ["department"],
+                },
+            },
+        },
+    ]
+
+    def __init__(self, company_id: int) -> None:
+        self.company_id = company_id
+        self._functions: Dict[str, Callable[..., Any]] = {
+            "find_employees": self.find_employees,
+            "project_members": self.project_members,
+            "find_tasks": self.find_tasks,
+            "department_roster": self.department_roster,
+        }
+        self._parameters: Dict[str, Dict[str, Any]] = {
+            schema["function"]["name"]: schema["function"]["parameters"] for schema in self.SCHEMAS
+        }
+
+    def run(self, name: str, arguments: str) -> str:
+        # Errors go back to the model as text so it can correct the call
+        function = self._functions.get(name)
+        if function is None:
+            return json.dumps({"error": f"unknown tool {name}"})
+        try:
+            values = json.loads(arguments or "{}")
+            _check_arguments(self._parameters[name], values)
+            result = function(**values)
+        except (TypeError, ValueError) as error:
+            return json.dumps({"error": str(error)}, ensure_ascii=False)
+        except (AttributeError, LookupError, SQLAlchemyError) as error:
+            # A failed query leaves the session unusable for the rest of the
+            # answer, so it is rolled back before the model gets the error
+            logger.exception("Tool %s failed", name)
+            db.session.rollback()
+            return json.dumps({"error": f"{name} failed: {error}"}, ensure_ascii=False)
+        return json.dumps(result, ensure_ascii=False)
+
+    def find_employees(self, name: str) -> List[Dict[str, Any]]:
+        words = name.split()
+        if not words:
+            return []
+        # Prefix ranges on (surname, name) are served by ix_employee_fullname
+        if len(words) == 1:
+            match = or_(
+                _prefix(Employee.surname, words[0]),
+                _prefix(Employee.name, words[0]),
+            )
+        else:
+            match = or_(
+                and_(_prefix(Employee.surname, words[0]), _prefix(Employee.name, words[1])),
+                and_(_prefix(Employee.surname, words[1]), _prefix(Employee.name, words[0])),
+            )
+        employees = (
+            Employee.query
+            .filter(Employee.company_id == self.company_id, match)
+            .options(joinedload(Employee.role), selectinload(Employee.departments))
+            .order_by(Employee.surname, Employee.name)
+            .limit(MAX_ROWS)
+        )
+        return [
+            dict(_employee_row(employee), departments=[d.name for d in employee.departments])
+            for employee in employees
+        ]
+
+    def _members(self, relationship, owner, owner_id: int) -> List[Dict[str, Any]]:
+        # The first MAX_ROWS members, limited in SQL rather than after
+        # loading the whole collection
+        employees = (
+            Employee.query
+            .join(relationship)
+            .filter(owner.id == owner_id)
+            .options(joinedload(Employee.role))
+            .order_by(Employee.surname, Employee.name)
+            .limit(MAX_ROWS)
+        )
+        return [_employee_row(employee) for employee in employees]
+
+    def project_members(self, project: str) -> Optional[Dict[str, Any]]:
+        ids = _starts_with(Project, self.company_id, project)
+        if not ids:
+            return None
+        found = Project.query.options(joinedload(Project.responsible_dept)).get(ids[0])
+        return {
+            "id": found.id,
+            "name": found.name,
+            "status": found.status.value,
+            "description": found.description,
+            "responsible_department": found.responsible_dept.name if found.responsible_dept else None,
+            "members": self._members(Employee.projects, Project, found.id),
+        }
+
+    def find_tasks(
+        self,
+        status: Optional[str] = None,
+        due_after: Optional[str] = None,
+        due_before: Optional[str] = None,
+        project: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        query = (
+            Task.query
+            .join(Project)
+            .filter(Project.company_id == self.company_id)
+            .options(joinedload(Task.project), selectinload(Task.employees))
+        )
+        # status + due_date filters are served by ix_task_status_due
+        if status:
+            query = query.filter(Task.status == Status(status))
+        if due_after:
+            query = query.filter(Task.due_date >= _parse_date(due_after))
+        if due_before:
+            query = query.filter(Task.due_date <= _parse_date(due_before))
+        if project:
+            query = query.filter(Project.id.in_(_starts_with(Project, self.company_id, project)))
+        return [_task_row(task) for task in query.order_by(Task.due_date).limit(MAX_ROWS)]
+
+    def department_roster(self, department: str) -> Optional[Dict[str, Any]]:
+        ids = _starts_with(Department, self.company_id, department)
+        if not ids:
+            return None
+        found = Department.query.options(selectinload(Department.projects)).get(ids[0])
+        return {
+            "id": found.id,
+            "name": found.name,
+            "description": found.description,
+            "employees": self._members(Employee.departments, Department, found.id),
+            "projects": [project.name for project in found.projects],
+        }
@@ -1,11 +1,32 @@
+import os
+import time
 from typing import Optional, List, Dict
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from flask import Flask, render_template, request, redirect, flash
-from flask_socketio import SocketIO, emit
+import click
+from flask import Flask, render_template, request, redirect, flash, jsonify, g, session
+from flask_socketio import SocketIO, emit, join_room
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 
-from ..ai import TextGenerator
+from ..ai import CHARS_PER_TOKEN, TextGenerator, estimate_tokens
+from ..answer_cache import AnswerCache
+from .. import board
+from .. import database
+from ..changes import on_commit, share
+from ..chat_history import page
+from ..context import CompanyContextCache
+from ..loading import profile
+from ..message_writer import MessageWriter
+from ..metrics import AssistantMetrics
+from ..conversations import ConversationStore
+from ..retrieval import RetrievalIndex
+from ..rooms import RoomStats, chat_room, company_room, project_room
+from .. import search
+from ..sidebar import SidebarChats
+from ..store import create_store
+from ..task_moves import TaskMoves
+from ..tools import CompanyTools
+from ..workers import AssistantBusy, AssistantPool
 from ..models import (
     db,
     Company,
@@ -38,50 +59,157 @@ import config
 
 socketio = SocketIO()
 
-app = Flask(__name__)
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///app.db"
+# INSTANCE_PATH (absolute) moves the instance folder, e.g. for benchmarks
+app = Flask(__name__, instance_path=os.environ.get('INSTANCE_PATH'))
+database.configure(app)
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 app.config["SECRET_KEY"] = "your_secret_key"
 
 db.init_app(app)
-socketio.init_app(app, async_mode='threading')
+# With several worker processes, emits reach clients of every process
+# through the message queue (e.g. redis://localhost:6379/0)
+socketio.init_app(
+    app,
+    async_mode=config.async_mode,
+    message_queue=config.socketio_message_queue
+)
 
 with app.app_context():
+    database.tune(db.engine)
     db.create_all()
-    selected_company = Company.query.first()
+    database.upgrade(db.engine, db.metadata)
+    search.install(db.engine)
+
+# State shared by the worker processes; commits of one process invalidate
+# the caches of all of them
+store = create_store(config.store_url, max_entries=config.store_max_entries)
+share(store, [mapper.class_ for mapper in db.Model.registry.mappers])
 
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
 
 text_generator = TextGenerator(
-    model=config.model,
-    key=config.key
+    backends=config.llm_backends,
+    timeout=config.llm_timeout,
+    hedge_after=config.llm_hedge_after,
+    retries=config.llm_retries,
+    breaker_failures=config.llm_breaker_failures,
+    breaker_cooldown=config.llm_breaker_cooldown,
+    max_connections=config.llm_max_connections
+)
+
+assistant_pool = AssistantPool(
+    max_workers=config.assistant_workers,
+    max_queue=config.assistant_queue_size,
+    per_user=config.assistant_jobs_per_user
+)
+
+assistant_metrics = AssistantMetrics()
+
+answer_cache = AnswerCache(
+    store,
+    ttl=config.answer_cache_ttl,
+    min_words=config.answer_cache_min_words
+)
+on_commit(answer_cache.invalidate)
+
+company_context = CompanyContextCache()
+on_commit(company_context.invalidate)
+
+retrieval_index = RetrievalIndex(
+    app,
+    directory=os.path.join(app.instance_path, 'retrieval'),
+    database=database.database_url(),
+    top_k=config.retrieval_top_k,
+    save_delay=config.retrieval_save_delay
+)
+on_commit(retrieval_index.invalidate)
+
+conversations = ConversationStore(
+    store,
+    max_messages=config.conversation_cache_messages,
+    idle_seconds=config.conversation_idle_seconds,
+    token_budget=config.conversation_token_budget
+)
+
+room_stats = RoomStats()
+
+sidebar_chats = SidebarChats(
+    max_chats=config.sidebar_chats,
+    max_users=config.sidebar_cache_users
 )
+on_commit(sidebar_chats.invalidate)
+
+
+def touch_chats(chat_ids: List[int]) -> None:
+    # New messages reorder the sidebars of every process
+    for chat_id in chat_ids:
+        sidebar_chats.touch(chat_id)
+
+
+store.subscribe('chat_touched', touch_chats)
+
+
+def current_company_id() -> Optional[int]:
+    # The company chosen on /company/<id> is kept in the user's session, so
+    # every worker process serves the same one; the first company otherwise
+    if 'company_id' not in g:
+        g.company_id = session.get('company_id') or db.session.scalar(
+            db.select(Company.id).order_by(Company.id).limit(1)
+        )
+    return g.company_id
 
-histories: Dict[int, List[Dict[str, str]]] = {}
-messages: Dict[int, List[Dict[str, str]]] = {}
 
 def get_all_employees() -> List[str]:
-    # This function fetches all employees and can be reused in routes
-    return [str(i) for i in Employee.query.filter(Employee.company_id == selected_company.id).all()]
+    # Rendered employees of the selected company, served from the context cache
+    return company_context.rows(current_company_id(), Employee)
 
 def get_all_projects() -> List[str]:
-    # This function fetches all projects and can be reused in routes
-    return [str(i) for i in Project.query.filter(Project.company_id == selected_company.id).all()]
+    # Rendered projects of the selected company, served from the context cache
+    return company_context.rows(current_company_id(), Project)
 
 def get_all_departments() -> List[str]:
-    # This function fetches all departments and can be reused in routes
-    return [str(i) for i in Department.query.filter(Department.company_id == selected_company.id).all()]
+    # Rendered departments of the selected company, served from the context cache
+    return company_context.rows(current_company_id(), Department)
 
 def get_all_tasks() -> List[str]:
-    # This function fetches all tasks and can be reused in routes
-    return [str(i) for i in Task.query.all()]
+    # Rendered tasks of the selected company's projects, served from the context cache
+    return company_context.rows(current_company_id(), Task)
+
+
+def get_company_context() -> List[Dict[str, str]]:
+    # The whole company pasted into the prompt, used when retrieval is off
+    if config.assistant_context == 'retrieval':
+        return []
+    return [
+        {"role": "system", "content": "Сотрудники" + str(get_all_employees())},
+        {"role": "system", "content": "Проекты" + str(get_all_projects())},
+        {"role": "system", "content": "Отделы" + str(get_all_departments())},
+        {"role": "system", "content": "Задачи" + str(get_all_tasks())}
+    ]
+
+
+def get_relevant_context(company_id: int, query: str) -> List[Dict[str, str]]:
+    # Only the top-k indexed rows that match the question. The first search
+    # of a company loads its index, so this runs on the assistant pool.
+    if config.assistant_context != 'retrieval':
+        return []
+    snippets = retrieval_index.search(company_id, query)
+    if not snippets:
+        return []
+    return [{
+        "role": "system",
+        "content": "Сведения из базы знаний компании, относящиеся к вопросу:\n"
+        + "\n".join("- " + snippet for snippet in snippets)
+    }]
 
 
 def get_chats():
-    # This function fetches all chats and can be reused in routes
-    return Chat.query.all()
+    # Chats of the current user for the sidebar, reused by all routes
+    if not current_user.is_authenticated:
+        return []
+    return sidebar_chats.chats(current_user.id)
 
 
 def serialize_task(task):
@@ -97,23 +225,117 @@ def serialize_task(task):
     }
 
 
+def serialize_event(event):
+    return {
+        "id": event.id,
+        "name": event.name,
+        "description": event.description,
+        "start_date": event.starts_at.date().isoformat(),
+        "due_date": event.ends_at.date().isoformat(),
+        "type": event.type.value,
+        "location": event.location,
+    }
+
+
 @socketio.on('user_message')
 def handle_user_message(data):
+    received = time.perf_counter()
     text = data.get('text', '')
-    histories[current_user.id] = histories.get(current_user.id, [
+    user_id = current_user.id
+    company_id = current_company_id()
+    sid = request.sid
+    question = {"role": "user", "content": text}
+    cache_key = answer_cache.key(company_id, text, conversations.history(user_id))
+    cached = answer_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        conversations.append(user_id, question, {"role": "assistant", "content": cached})
+        emit('assistant_done', {'text': cached})
+        assistant_metrics.record(
+            user_id, company_id, 'cached', latency=time.perf_counter() - received
+        )
+        return
+    system = [
         {"role": "system", "content": config.assistant_system_prompt},
-        {"role": "system", "content": "Сотрудники" + str(get_all_employees())},
-        {"role": "system", "content": "Проекты" + str(get_all_projects())},
-        {"role": "system", "content": "Отделы" + str(get_all_departments())},
-        {"role": "system", "content": "Задачи" + str(get_all_tasks())}
-    ])
-    messages[current_user.id] = messages.get(current_user.id, [])
-    messages[current_user.id].append({"role": "user", "content": text})
-    histories[current_user.id].append({"role": "user", "content": text})
-    answer = text_generator.generate(histories[current_user.id])
-    histories[current_user.id].append({"role": "assistant", "content": answer})
-    messages[current_user.id].append({"role": "assistant", "content": answer})
-    emit('assistant_message', {'text': answer})
+        *get_company_context()
+    ]
+
+    tools = CompanyTools(company_id) if config.assistant_tools else None
+
+    # Runs on the assistant pool with its own app context for tool queries.
+    # Whatever it raises is logged and reported to the client here, since
+    # the pool's future is never read.
+    def answer_question(cancelled):
+        started = time.perf_counter()
+        first_token = None
+        finished = None
+        usage = {}
+        parts = []
+        history = []
+        outcome = 'ok'
+        try:
+            with app.app_context():
+                # Retrieved snippets are sent with this turn only and not kept in history
+                history = conversations.prompt(
+                    user_id, system + get_relevant_context(company_id, text), question
+                )
+                stream = text_generator.stream(
+                    history,
+                    tools=CompanyTools.SCHEMAS if tools else None,
+                    run_tool=tools.run if tools else None,
+                    usage=usage
+                )
+                try:
+                    for part in stream:
+                        if cancelled.is_set():
+                            outcome = 'cancelled'
+                            return
+                        if first_token is None:
+                            first_token = time.perf_counter() - received
+                        parts.append(part)
+                        socketio.emit('assistant_chunk', {'text': part}, to=sid)
+                finally:
+                    stream.close()
+                    finished = time.perf_counter()
+                answer = {"role": "assistant", "content": "".join(parts)}
+                conversations.append(user_id, question, answer)
+                if cache_key:
+                    answer_cache.put(cache_key, answer["content"])
+            socketio.emit('assistant_done', {'text': answer["content"]}, to=sid)
+        except Exception as error:
+            outcome = 'error'
+            app.logger.exception("Assistant answer for user %s failed", user_id)
+            socketio.emit('assistant_error', {'error': str(error)}, to=sid)
+        finally:
+            # Backends that do not report usage get a local estimate
+            assistant_metrics.record(
+                user_id,
+                company_id,
+                outcome,
+                model=usage.get('model'),
+                backend=usage.get('backend'),
+                prompt_tokens=usage.get('prompt_tokens') or estimate_tokens(history),
+                completion_tokens=(
+                    usage.get('completion_tokens')
+                    or len("".join(parts)) // CHARS_PER_TOKEN
+                ),
+                estimated='prompt_tokens' not in usage,
+                queue_wait=started - received,
+                first_token=first_token,
+                latency=(finished or time.perf_counter()) - received
+            )
+
+    try:
+        assistant_pool.submit(user_id, sid, answer_question)
+    except AssistantBusy as busy:
+        emit('assistant_error', {'error': 'busy', 'message': str(busy)})
+        assistant_metrics.record(user_id, company_id, 'rejected')
+
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    # Stop generating answers nobody is going to read
+    assistant_pool.cancel(request.sid)
+    room_stats.left(request.sid)
 
 
 @login_manager.user_loader
@@ -126,12 +348,70 @@ def inject_now():
     return {'now': datetime.now}
 
 
+@socketio.on('clear_history')
+def handle_clear_history():
+    conversations.clear(current_user.id)
+
+
+@app.route('/assistant/stats')
+@login_required
+def assistant_stats():
+    return jsonify({
+        'calls': assistant_metrics.stats(current_user.id, current_company_id()),
+        'queue': {
+            'pending': assistant_pool.pending,
+            'workers': assistant_pool.max_workers,
+            'queue_size': assistant_pool.max_queue
+        },
+        'answer_cache': answer_cache.stats(),
+        'backends': text_generator.stats()
+    })
+
+
+@app.route('/search')
+@login_required
+def search_company():
+    # Ranked full-text matches in the selected company, e.g. /search?q=отчет&kinds=task,project
+    if not search.supported(db.engine):
+        return jsonify({'error': 'search needs SQLite with FTS5'}), 501
+    kinds = request.args.get('kinds')
+    employee = current_user.employee
+    results = search.search(
+        db.engine,
+        current_company_id(),
+        request.args.get('q', ''),
+        employee_id=employee.id if employee else None,
+        kinds=kinds.split(',') if kinds else None,
+        limit=max(1, min(request.args.get('limit', 20, type=int), config.search_max_results))
+    )
+    return jsonify({'results': results})
+
+
+@app.cli.command('rebuild-search')
+def rebuild_search():
+    # flask --app app.web.app rebuild-search
+    click.echo(f'Indexed {search.rebuild(db.engine)} rows')
+
+
+@app.route('/realtime/stats')
+@login_required
+def realtime_stats():
+    # Socket.IO room subscribers and write batching of this process
+    return jsonify({
+        'async_mode': socketio.async_mode,
+        'rooms': room_stats.stats(),
+        'chat_writer': message_writer.stats() if message_writer else None,
+        'task_moves': task_moves.stats()
+    })
+
+
 @app.route('/assistant')
+@login_required
 def assistant():
     return render_template(
         'assistant.html',
         chats=get_chats(),
-        messages=messages.get(current_user.id, [])
+        messages=conversations.history(current_user.id)
     )
 
 
@@ -159,7 +439,7 @@ def register():
             birth_date=birth_date,
             contacts=contacts,
             email=email,
-            company_id=selected_company.id
+            company_id=current_company_id()
         )
         employee.user = user
         db.session.add(employee)
@@ -204,9 +484,9 @@ def index():
 
 @app.route("/departments")
 def departments():
-    departments = Company.query.filter(
-        Company.id == selected_company.id
-    ).first().departments  # type: ignore
+    departments = Department.query.filter(
+        Department.company_id == current_company_id()
+    ).options(*profile('department_list')).all()
     return render_template('departments.html', departments=departments, active_page='departments', chats=get_chats())
 
 
@@ -217,7 +497,7 @@ def create_department():
         name = form.name.data
         description = form.description.data
         department = Department(
-            name=name, description=description, company_id=selected_company.id  # type: ignore
+            name=name, description=description, company_id=current_company_id()  # type: ignore
         )
         db.session.add(department)
         db.session.commit()
@@ -230,7 +510,7 @@ def create_department():
 @app.route("/chat/create", methods=["GET", "POST"])
 def create_chat():
     form = ChatForm()
-    employees = Employee.query.filter(Employee.company_id == selected_company.id).all()
+    employees = Employee.query.filter(Employee.company_id == current_company_id()).all()
     form.employees.choices = [
         (employee.id, employee.full_name) for employee in employees
     ]
@@ -255,36 +535,132 @@ def create_chat():
 
 
 @app.route('/chat/<int:chat_id>')
+@login_required
 def chat(chat_id: int):
     chat = Chat.query.get_or_404(chat_id)
-    messages = chat.messages.order_by(Message.timestamp).all()  # type: ignore
+    # Same membership check as /messages and join_chat
+    if chat_member(chat_id) is None:
+        return "Not a member of this chat", 403
+    # Only the newest page; older messages are fetched from /messages on scroll
+    messages, older = page(chat_id, config.chat_page_size)
     # Pass the specific chat and all chats for the sidebar to the template
     return render_template(
-        'chat.html', chat=chat, active_page=f'chat_{chat_id}', chats=get_chats(), messages=messages
+        'chat.html', chat=chat, active_page=f'chat_{chat_id}', chats=get_chats(),
+        messages=messages, older=older
     )
 
 
+@app.route('/chat/<int:chat_id>/messages')
+@login_required
+def chat_messages(chat_id: int):
+    Chat.query.get_or_404(chat_id)
+    if chat_member(chat_id) is None:
+        return jsonify({'error': 'not a member'}), 403
+    limit = min(request.args.get('limit', config.chat_page_size, type=int), config.chat_page_size)
+    try:
+        messages, older = page(chat_id, max(limit, 1), request.args.get('before'))
+    except ValueError:
+        return jsonify({'error': 'invalid cursor'}), 400
+    return jsonify({
+        'messages': [message.to_dict() for message in messages],
+        'older': older
+    })
+
+
+def chat_member(chat_id: int) -> Optional[Employee]:
+    # The current user's employee if they are a member of the chat
+    if not current_user.is_authenticated:
+        return None
+    return Employee.query.join(Employee.chats).filter(
+        Employee.user_id == current_user.id, Chat.id == chat_id
+    ).first()
+
+
+def deliver_messages(messages: List[Dict]) -> None:
+    # Members with the chat open get the message over their socket
+    for data in messages:
+        socketio.emit('chat_message', data, to=chat_room(data['chat_id']))
+    store.publish('chat_touched', [data['chat_id'] for data in messages])
+
+
+message_writer = MessageWriter(
+    app,
+    max_batch=config.chat_batch_size,
+    max_delay=config.chat_batch_delay,
+    durability=config.chat_durability,
+    on_written=deliver_messages
+) if config.chat_group_commit else None
+
+
+@app.route('/chat/writer/stats')
+@login_required
+def chat_writer_stats():
+    # Group commit batches of this process; None when chat_group_commit is off
+    return jsonify(message_writer.stats() if message_writer else None)
+
+
+def post_message(chat_id: int, sender: Employee, content: str) -> Optional[Dict]:
+    # None when the message is only queued (chat_durability = 'queued')
+    if message_writer is not None:
+        sender_id, sender_name = sender.id, sender.full_name
+        # Release the connection while waiting for the group commit
+        db.session.remove()
+        return message_writer.write(chat_id, sender_id, sender_name, content)
+    # By id: assigning the relationship would mark the sender's row changed
+    message = Message(content=content, chat_id=chat_id, sender_id=sender.id)
+    db.session.add(message)
+    db.session.commit()
+    data = message.to_dict()
+    deliver_messages([data])
+    return data
+
+
 @app.route('/chat/<int:chat_id>/send_message', methods=['POST'])
 def send_message(chat_id: int):
-    chat = Chat.query.get_or_404(chat_id)
+    # Form fallback for clients without a socket connection
+    Chat.query.get_or_404(chat_id)
     content = request.form.get('message_content')
-    # You will need to get the actual sender employee ID here.
-    # For now, I'll use a placeholder (e.g., first employee found).
-    # In a real application, this would come from the logged-in user's session.
-    sender = Employee.query.first()  # Placeholder for sender
-
+    sender = chat_member(chat_id)
     if content and sender:
-        message = Message(content=content, chat=chat, sender=sender)
-        db.session.add(message)
-        db.session.commit()
-        print(f"Message sent successfully: {message.content}")  # Debug print
-    else:
-        print("Failed to send message: content or sender missing.")  # Debug print
+        post_message(chat_id, sender, content)
 
     # Redirect back to the chat page
     return redirect(f'/chat/{chat_id}')
 
 
+@socketio.on('join_chat')
+def handle_join_chat(data):
+    try:
+        chat_id = int(data['chat_id'])
+    except (KeyError, TypeError, ValueError):
+        return {'ok': False, 'error': 'invalid chat'}
+    if chat_member(chat_id) is None:
+        return {'ok': False, 'error': 'not a member'}
+    join_room(chat_room(chat_id))
+    room_stats.joined(request.sid, chat_room(chat_id))
+    return {'ok': True}
+
+
+@socketio.on('chat_message')
+def handle_chat_message(data):
+    # The return value is the acknowledgement sent back to the sender
+    try:
+        chat_id = int(data['chat_id'])
+    except (KeyError, TypeError, ValueError):
+        return {'ok': False, 'error': 'invalid chat'}
+    content = str(data.get('text') or '').strip()
+    if not content:
+        return {'ok': False, 'error': 'empty message'}
+    sender = chat_member(chat_id)
+    if sender is None:
+        return {'ok': False, 'error': 'not a member'}
+    try:
+        message = post_message(chat_id, sender, content)
+    except Exception:
+        return {'ok': False, 'error': 'not saved'}
+    return {'ok': True, 'message': message}
+
+
 @app.route('/chat/<int:chat_id>/history', methods=['DELETE'])
 def delete_chat_history(chat_id: int):
     chat = Chat.query.get_or_404(chat_id)
@@ -322,21 +698,16 @@ def create_company():
 @app.route('/company/', defaults={'company_id': None})
 @app.route("/company/<int:company_id>")
 def company(company_id: Optional[int]):
-    global selected_company
-    if company_id:
-        selected_company = Company.query.filter(Company.id == company_id).first()
-    # Ensure selected_company is set if no ID is provided (e.g., first run)
-    if not selected_company:
-        # Or handle as an error/setup case
-        selected_company = Company.query.first()
-    if selected_company:
-        selected_company = Company.query.filter(
-            Company.id == selected_company.id
-        ).first()
+    # Opening a company selects it for the rest of the session
+    if company_id and Company.query.get(company_id) is not None:
+        session['company_id'] = g.company_id = company_id
+    company = Company.query.filter(
+        Company.id == current_company_id()
+    ).options(*profile('company_page')).first()
     # Pass chats to the template for the sidebar
     return render_template(
         'company.html',
-        company=selected_company,
+        company=company,
         active_page='company',
         chats=get_chats()
     )
@@ -344,43 +715,71 @@ def company(company_id: Optional[int]):
 
 @app.route('/tasks')
 def tasks():
-    company = Company.query.filter_by(id=selected_company.id).first()
+    company = Company.query.filter_by(id=current_company_id()).first()
     if not company:
         return "Company not found", 404
 
     form = ProjectIdForm(request.args)
     form.project_id.choices.extend(
-        [(project.id, project.name) for project in company.projects]
+        (project.id, project.name)
+        for project in Project.query.filter(Project.company_id == company.id)
+        .with_entities(Project.id, Project.name)
     )
 
-    tasks = []
+    # Read before the tasks; the board catches up from here after a reconnect
+    board_cursor = board.cursor()
+    tasks = Task.query.join(Project).filter(
+        Project.company_id == current_company_id()
+    ).options(*profile('task_board'))
     project_id = request.args.get('project_id', type=int)
     if project_id:
-        project = Project.query.get_or_404(project_id)
-        tasks = project.tasks
+        Project.query.get_or_404(project_id)
+        tasks = tasks.filter(Task.project_id == project_id)
         form.project_id.data = project_id
-    else:
-        tasks = Task.query.join(Project).filter(
-            Project.company_id == selected_company.id
-        ).all()
+    tasks = tasks.all()
     return render_template(
         'tasks.html',
         active_page='tasks',
         chats=get_chats(),
         tasks=tasks,
+        board_cursor=board_cursor,
+        project_id=project_id,
         form=form
     )
 
 
+@app.route('/tasks/board')
+def tasks_board():
+    # The whole board as JSON. The ETag is the change log revision, so an
+    # unchanged board answers 304 after a single aggregate lookup.
+    project_id = request.args.get('project_id', type=int)
+    etag = f'{current_company_id()}-{project_id or 0}-{board.revision()}'
+    if request.if_none_match.contains(etag):
+        return '', 304, {'ETag': f'"{etag}"'}
+    response = jsonify(board.board(current_company_id(), project_id))
+    response.set_etag(etag)
+    return response
+
+
+@app.route('/tasks/board/changes')
+def tasks_board_changes():
+    # Cards changed since a cursor, e.g. /tasks/board/changes?since=120&project_id=3
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({'error': 'since is required'}), 400
+    project_id = request.args.get('project_id', type=int)
+    return jsonify(board.changes_since(current_company_id(), since, project_id))
+
+
 @app.route('/task/create', methods=['GET', 'POST'])
 def create_task():
     form = TaskForm()
     projects = Project.query.filter(
-        Project.company_id == selected_company.id
+        Project.company_id == current_company_id()
     ).all()
     form.project_id.choices = [(project.id, project.name) for project in projects]
     employees = Employee.query.filter(
-        Employee.company_id == selected_company.id
+        Employee.company_id == current_company_id()
     ).all()
     form.employees.choices = [(employee.id, employee.full_name) for employee in employees]
     if form.validate_on_submit():
@@ -408,22 +807,7 @@ def create_task():
         db.session.add(task)
         db.session.commit()
 
-        task_data = {
-            "id": task.id,
-            "name": task.name,
-            "status": task.status.value,
-            "index": task.index,
-            "employees": [
-                {
-                    "index": employee.index, 
-                    "id": employee.id, 
-                    "full_name": employee.full_name
-                }
-                for employee in task.employees
-            ],
-        }
-
-        socketio.emit('task_created', task_data)
+        socketio.emit('task_created', board.task_card(task), to=board_rooms(task.project))
 
         return redirect('/tasks')
     return render_template(
@@ -435,35 +819,66 @@ def create_task():
 
 @app.route('/calendar/', methods=['GET'])
 def calendar():
-    company = Company.query.filter_by(id=selected_company.id).first()
+    company = Company.query.filter_by(id=current_company_id()).first()
     if not company:
         return "Company not found", 404
 
     form = ProjectIdForm(request.args)
     form.project_id.choices.extend(
-        [(project.id, project.name) for project in company.projects]
+        (project.id, project.name)
+        for project in Project.query.filter(Project.company_id == company.id)
+        .with_entities(Project.id, Project.name)
     )
-
-    tasks = []
     project_id = request.args.get('project_id', type=int)
     if project_id:
-        project = Project.query.get_or_404(project_id)
-        tasks = project.tasks
+        Project.query.get_or_404(project_id)
         form.project_id.data = project_id
-    else:
-        tasks = Task.query.join(Project).filter(
-            Project.company_id == selected_company.id
-        ).all()
 
+    # Tasks of the visible month are fetched by calendar.js from /calendar/range
     return render_template(
         'calendar.html',
         active_page='calendar',
         chats=get_chats(),
-        tasks=[serialize_task(task) for task in tasks],
+        project_id=project_id,
         form=form
     )
 
 
+@app.route('/calendar/range', methods=['GET'])
+def calendar_range():
+    # Tasks and HR events overlapping [start, end], one interval record each,
+    # e.g. /calendar/range?start=2024-05-27&end=2024-07-07&project_id=3
+    try:
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d').date()
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d').date()
+    except (KeyError, ValueError):
+        return jsonify({'error': 'start and end must be YYYY-MM-DD'}), 400
+    if end < start or (end - start).days > config.calendar_max_days:
+        return jsonify({'error': f'window must be 0-{config.calendar_max_days} days'}), 400
+
+    # Overlap test served by ix_task_project_due for each of the company's projects
+    tasks = Task.query.join(Project).filter(
+        Project.company_id == current_company_id(),
+        Task.start_date <= end,
+        Task.due_date >= start
+    ).options(*profile('calendar'))
+    project_id = request.args.get('project_id', type=int)
+    if project_id:
+        tasks = tasks.filter(Task.project_id == project_id)
+
+    # Events of the window, organized by the company's employees
+    events = HREvent.query.join(HREvent.organizer).filter(
+        Employee.company_id == current_company_id(),
+        HREvent.starts_at < datetime.combine(end + timedelta(days=1), datetime.min.time()),
+        HREvent.ends_at >= datetime.combine(start, datetime.min.time())
+    ) if not project_id else []
+
+    return jsonify({
+        'tasks': [serialize_task(task) for task in tasks],
+        'events': [serialize_event(event) for event in events]
+    })
+
+
 @app.route("/companies")
 def companies():
     companies = Company.query.all()
@@ -473,13 +888,9 @@ def companies():
 
 @app.route("/projects")
 def projects():
-    # Ensure selected_company is set
-    if not selected_company:
-        # Placeholder - add appropriate handling
-        pass
     projects = Project.query.filter(
-        Project.company_id == selected_company.id
-    ).all()
+        Project.company_id == current_company_id()
+    ).options(*profile('project_list')).all()
     # Pass chats to the template for the sidebar
     return render_template('projects.html', projects=projects, active_page='projects', chats=get_chats())
 
@@ -487,9 +898,9 @@ def projects():
 @app.route("/project/create", methods=["GET", "POST"])
 def create_project():
     form = ProjectForm()
-    departments = Company.query.filter(Company.id == selected_company.id).first().departments
+    departments = Company.query.filter(Company.id == current_company_id()).first().departments
     form.responsible_department_id.choices = [(d.id, d.name) for d in departments]
-    employees = Employee.query.filter(Employee.company_id == selected_company.id).all()
+    employees = Employee.query.filter(Employee.company_id == current_company_id()).all()
     form.employees.choices = [(employee.id, employee.full_name) for employee in employees]
     if form.validate_on_submit():
         name = form.name.data
@@ -500,7 +911,7 @@ def create_project():
             name=name,
             description=description,
             responsible_dept_id=responsible_department_id,
-            company_id=selected_company.id
+            company_id=current_company_id()
         )
         db.session.add(project)
         for employee_id in employees_ids:
@@ -513,29 +924,87 @@ def create_project():
 
 @app.route("/employees")
 def employees():
-    # Ensure selected_company is set
-    if not selected_company:
-        # Placeholder - add appropriate handling
-        pass
     employees = Employee.query.filter(
-        Employee.company_id == selected_company.id
-    ).all()
+        Employee.company_id == current_company_id()
+    ).options(*profile('employee_list')).all()
     # Pass chats to the template for the sidebar
     return render_template('employees.html', employees=employees, active_page='employees', chats=get_chats())
 
 
+def board_rooms(project: Project) -> List[str]:
+    # Viewers of the whole company board and of this project's board
+    return [company_room(project.company_id), project_room(project.id)]
+
+
+def broadcast_moves(moved: List[Dict]) -> None:
+    for data in moved:
+        rooms = [company_room(data.pop('company_id'))]
+        # Tasks without a project are only on the company board
+        project_id = data.pop('project_id')
+        if project_id is not None:
+            rooms.append(project_room(project_id))
+        socketio.emit('task_moved', data, to=rooms)
+
+
+@socketio.on('join_board')
+def handle_join_board(data):
+    # A kanban page subscribes to its company's board, or to one project's
+    try:
+        project_id = data.get('project_id')
+        project_id = int(project_id) if project_id else None
+    except (AttributeError, TypeError, ValueError):
+        return {'ok': False, 'error': 'invalid project'}
+    if project_id:
+        project = Project.query.filter(
+            Project.id == project_id, Project.company_id == current_company_id()
+        ).first()
+        if project is None:
+            return {'ok': False, 'error': 'not found'}
+        room = project_room(project.id)
+    else:
+        room = company_room(current_company_id())
+    join_room(room)
+    room_stats.joined(request.sid, room)
+    return {'ok': True}
+
+
+task_moves = TaskMoves(app, window=config.task_move_window, on_moved=broadcast_moves)
+
+
+def parse_moves(moves) -> List:
+    # (task_id, status, version) triples; raises ValueError on bad input
+    return [
+        (int(move['task_id']), Status(move['new_status']).value, int(move['version']))
+        for move in moves
+    ]
+
+
 @socketio.on('move_task')
 def handle_move_task(data):
-    task_id = int(data['task_id'])
-    new_status = data['new_status']
-    task = Task.query.get(task_id)
-    task.status = Status(new_status)
-    db.session.commit()
-    if task:
-        task.status = new_status
-        db.session.commit()
-        # Уведомляем всех, кроме отправителя
-        emit('task_moved', {'task_id': task_id, 'new_status': new_status}, broadcast=True, include_self=False)
+    # Acknowledged with the task's current status and version; on a conflict
+    # the client puts the card back where the server has it
+    try:
+        moves = parse_moves([data])
+    except (KeyError, TypeError, ValueError):
+        return {'ok': False, 'error': 'invalid move'}
+    try:
+        return task_moves.move(request.sid, current_company_id(), moves)[0]
+    except Exception:
+        return {'ok': False, 'error': 'not saved'}
+
+
+@socketio.on('move_tasks')
+def handle_move_tasks(data):
+    # Several cards dragged together, e.g. {'moves': [{task_id, new_status, version}, ...]}
+    try:
+        moves = parse_moves(data['moves'])
+    except (KeyError, TypeError, ValueError):
+        return {'ok': False, 'error': 'invalid move'}
+    try:
+        results = task_moves.move(request.sid, current_company_id(), moves)
+    except Exception:
+        return {'ok': False, 'error': 'not saved'}
+    return {'ok': True, 'results': results}
 
 
 @app.route('/company/edit/<int:company_id>', methods=['GET', 'POST'])
@@ -555,6 +1024,8 @@ def delete_company(company_id):
     company = Company.query.get_or_404(company_id)
     db.session.delete(company)
     db.session.commit()
+    if session.get('company_id') == company_id:
+        session.pop('company_id')
     flash('Компания удалена.')
     return redirect('/companies')
 
@@ -586,11 +1057,11 @@ def edit_project(project_id):
     form = ProjectForm(obj=project)
     # Не забудьте подгрузить choices!
     departments = Department.query.filter(
-        Department.company_id == selected_company.id
+        Department.company_id == current_company_id()
     ).all()
     form.responsible_department_id.choices = [(d.id, d.name) for d in departments]
     employees = Employee.query.filter(
-        Employee.company_id == selected_company.id
+        Employee.company_id == current_company_id()
     ).all()
     form.employees.choices = [(e.id, e.full_name) for e in employees]
     if request.method == 'GET':
@@ -619,11 +1090,11 @@ def edit_task(task_id):
     task = Task.query.get_or_404(task_id)
     form = TaskForm(obj=task)
     projects = Project.query.filter(
-        Project.company_id == selected_company.id
+        Project.company_id == current_company_id()
     ).all()
     form.project_id.choices = [(p.id, p.name) for p in projects]
     employees = Employee.query.filter(
-        Employee.company_id == selected_company.id
+        Employee.company_id == current_company_id()
     ).all()
     form.employees.choices = [(e.id, e.full_name) for e in employees]
     if request.method == 'GET':
@@ -18,14 +18,14 @@ function isSameDay(d1, d2) {
 }
 
 // ========== Task mapping ==========
-function buildEventsByDate(tasks) {
-    // Группируем таски по датам (start_date..due_date)
+function buildEventsByDate(records, windowStart, windowEnd) {
+    // Группируем интервалы по датам, только в пределах видимого окна
     let events = {};
-    tasks.forEach(task => {
+    records.forEach(task => {
         // Игнорируем если нет дат
         if (!task.start_date || !task.due_date) return;
-        let cur = new Date(task.start_date);
-        const end = new Date(task.due_date);
+        let cur = new Date(task.start_date > windowStart ? task.start_date : windowStart);
+        const end = new Date(task.due_date < windowEnd ? task.due_date : windowEnd);
         while (cur <= end) {
             const key = formatDateISO(cur);
             if (!events[key]) events[key] = [];
@@ -36,7 +36,32 @@ function buildEventsByDate(tasks) {
     return events;
 }
 
-const eventsByDate = buildEventsByDate(tasks);
+let eventsByDate = {};
+let windowRequest = 0;
+
+function monthWindow(month, year) {
+    const pad = n => n.toString().padStart(2, '0');
+    return {
+        start: `${year}-${pad(month + 1)}-01`,
+        end: `${year}-${pad(month + 1)}-${pad(getDaysInMonth(month, year))}`
+    };
+}
+
+function loadWindow(month, year) {
+    // Сервер возвращает только задачи и события, пересекающие месяц
+    const range = monthWindow(month, year);
+    const params = new URLSearchParams(range);
+    if (calendarProjectId) params.set('project_id', calendarProjectId);
+    const request = ++windowRequest;
+    return fetch(`/calendar/range?${params}`)
+        .then(response => response.json())
+        .then(data => {
+            // Ответ на уже неактуальный месяц не нужен
+            if (request !== windowRequest) return false;
+            eventsByDate = buildEventsByDate(data.tasks.concat(data.events), range.start, range.end);
+            return true;
+        });
+}
 
 // ========== DOM elements ==========
 const monthSelect = document.querySelector('.month-select');
@@ -99,6 +124,12 @@ function handleDayClick(e) {
 }
 
 function renderCalendar(month, year) {
+    loadWindow(month, year).then(current => {
+        if (current) drawCalendar(month, year);
+    });
+}
+
+function drawCalendar(month, year) {
     const daysInMonth = getDaysInMonth(month, year);
     const firstWeekday = getFirstWeekdayOfMonth(month, year); // 0 = Пн
 
@@ -5,16 +5,7 @@ let draggedCard = null;
 
 // Навесим обработчики на все карточки и колонки
 function initDragAndDrop() {
-    document.querySelectorAll('.kanban-card').forEach(card => {
-        card.addEventListener('dragstart', (e) => {
-            draggedCard = card;
-            setTimeout(() => card.classList.add('dragging'), 0);
-        });
-        card.addEventListener('dragend', (e) => {
-            card.classList.remove('dragging');
-            draggedCard = null;
-        });
-    });
+    document.querySelectorAll('.kanban-card').forEach(bindCard);
 
     document.querySelectorAll('.kanban-column').forEach(column => {
         column.addEventListener('dragover', (e) => {
@@ -22,34 +13,98 @@ function initDragAndDrop() {
         });
         column.addEventListener('drop', (e) => {
             if (draggedCard) {
-                const taskId = draggedCard.dataset.taskId;
                 const newStatus = column.dataset.status;
-                // Локально перемещаем карточку
-                column.appendChild(draggedCard);
-                // Отправляем через сокет
-                socket.emit('move_task', {
-                    task_id: taskId,
-                    new_status: newStatus
+                // Выделенные карточки (Ctrl/Cmd + клик) переносятся вместе
+                const cards = draggedCard.classList.contains('selected')
+                    ? Array.from(document.querySelectorAll('.kanban-card.selected'))
+                    : [draggedCard];
+                cards.forEach(card => {
+                    // Локально перемещаем карточку
+                    column.appendChild(card);
+                    queueMove(card, newStatus);
                 });
             }
         });
     });
 }
 
+// ========== Отправка перемещений ==========
+// Перемещения копятся MOVE_DELAY мс: серия перетаскиваний одной карточки
+// уходит на сервер одним перемещением, несколько карточек — одним move_tasks
+const MOVE_DELAY = 150;
+const pendingMoves = new Map();   // task_id -> new_status
+const inflightMoves = new Set();  // task_id, ждущие подтверждения
+let moveTimer = null;
 
-socket.on('task_created', function(task) {
-    // Определи колонку по статусу
-    const column = document.querySelector(`.kanban-column[data-status="${task.status}"]`);
-    if (!column) return;
+function queueMove(card, newStatus) {
+    pendingMoves.set(card.dataset.taskId, newStatus);
+    clearTimeout(moveTimer);
+    moveTimer = setTimeout(flushMoves, MOVE_DELAY);
+}
 
+function flushMoves() {
+    // Карточки с неподтверждённым перемещением ждут новой версии
+    const moves = [];
+    pendingMoves.forEach((newStatus, taskId) => {
+        if (inflightMoves.has(taskId)) return;
+        const card = document.querySelector(`.kanban-card[data-task-id="${taskId}"]`);
+        pendingMoves.delete(taskId);
+        if (!card) return;
+        inflightMoves.add(taskId);
+        moves.push({task_id: taskId, new_status: newStatus, version: card.dataset.version});
+    });
+    if (moves.length === 1) {
+        socket.emit('move_task', moves[0], result => applyMoveResults([result], moves));
+    } else if (moves.length > 1) {
+        socket.emit('move_tasks', {moves: moves}, data => applyMoveResults(data.results || [], moves));
+    }
+}
+
+function applyMoveResults(results, moves) {
+    let conflicts = 0;
+    moves.forEach(move => inflightMoves.delete(move.task_id));
+    results.forEach(result => {
+        if (!result.task_id) return;
+        const card = document.querySelector(`.kanban-card[data-task-id="${result.task_id}"]`);
+        if (!card || result.error) return;
+        card.dataset.version = result.version;
+        if (result.conflict) {
+            // Сервер уже принял чужое перемещение: возвращаем карточку туда, где она на самом деле
+            conflicts++;
+            pendingMoves.delete(String(result.task_id));
+            const column = document.querySelector(`.kanban-column[data-status="${result.status}"]`);
+            if (column) column.appendChild(card);
+        }
+    });
+    if (conflicts) alert('Часть задач уже переместил другой пользователь, доска обновлена.');
+    if (pendingMoves.size) flushMoves();
+}
+
+
+function bindCard(card) {
+    card.addEventListener('click', (e) => {
+        if (e.ctrlKey || e.metaKey) card.classList.toggle('selected');
+    });
+    card.addEventListener('dragstart', (e) => {
+        draggedCard = card;
+        setTimeout(() => card.classList.add('dragging'), 0);
+    });
+    card.addEventListener('dragend', (e) => {
+        card.classList.remove('dragging');
+        draggedCard = null;
+    });
+}
+
+function createCard(task) {
     // Собери HTML для новой карточки (по аналогии с твоим шаблоном)
     const card = document.createElement('div');
     card.className = 'kanban-card project-card';
     card.setAttribute('draggable', 'true');
     card.dataset.taskId = task.id;
+    card.dataset.version = task.version;
     card.innerHTML = `
         <div class="project-card-header">
-            <div class="project-card-heading">${task.name}</div>
+            <div class="project-card-heading"></div>
             <div class="project-card-actions">
                 <svg xmlns="http://www.w3.org/2000/svg" width="16" height="16" viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round" class="text-grey hover:text-grey-l20 active:text-grey-d20" type="ui"><path d="M12 12m-1 0a1 1 0 1 0 2 0a1 1 0 1 0 -2 0"></path><path d="M12 19m-1 0a1 1 0 1 0 2 0a1 1 0 1 0 -2 0"></path><path d="M12 5m-1 0a1 1 0 1 0 2 0a1 1 0 1 0 -2 0"></path></svg>
             </div>
@@ -62,27 +117,68 @@ socket.on('task_created', function(task) {
             <div class="employee-bubble">...</div>
         </div>
     `;
-    // Вставляем карточку
-    column.appendChild(card);
+    card.querySelector('.project-card-heading').textContent = task.name;
+    bindCard(card);
+    return card;
+}
 
-    // Не забудь навесить обработчики drag&drop!
-    card.addEventListener('dragstart', (e) => {
-        draggedCard = card;
-        setTimeout(() => card.classList.add('dragging'), 0);
-    });
-    card.addEventListener('dragend', (e) => {
-        card.classList.remove('dragging');
-        draggedCard = null;
-    });
+// Карточка с сервера: новую создаём, существующую обновляем и переносим
+function upsertCard(task) {
+    if (boardProjectId && String(task.project_id) !== boardProjectId) return;
+    const column = document.querySelector(`.kanban-column[data-status="${task.status}"]`);
+    if (!column) return;
+    const existing = document.querySelector(`.kanban-card[data-task-id="${task.id}"]`);
+    if (existing) {
+        existing.dataset.version = task.version;
+        existing.querySelector('.project-card-heading').textContent = task.name;
+        if (existing.parentElement !== column) column.appendChild(existing);
+        return;
+    }
+    column.appendChild(createCard(task));
+}
+
+// ========== Догоняем пропущенные изменения ==========
+const board = document.querySelector('.kanban-board');
+let boardCursor = parseInt(board.dataset.cursor) || 0;
+const boardProjectId = board.dataset.projectId;
+
+function catchUp() {
+    // Только изменения после курсора, без перезагрузки страницы
+    const params = new URLSearchParams({since: boardCursor});
+    if (boardProjectId) params.set('project_id', boardProjectId);
+    fetch(`/tasks/board/changes?${params}`)
+        .then(response => response.json())
+        .then(data => {
+            if (data.reset) {
+                location.reload();
+                return;
+            }
+            data.removed.forEach(id => {
+                const card = document.querySelector(`.kanban-card[data-task-id="${id}"]`);
+                if (card) card.remove();
+            });
+            data.tasks.forEach(upsertCard);
+            boardCursor = Math.max(boardCursor, data.cursor);
+        });
+}
+
+// При каждом (пере)подключении подписываемся на доску и запрашиваем то,
+// что могли пропустить
+socket.on('connect', function() {
+    socket.emit('join_board', {project_id: boardProjectId || null}, catchUp);
 });
 
+socket.on('task_created', upsertCard);
+
 // При получении сигнала от сервера двигаем карточку
 socket.on('task_moved', data => {
-    const { task_id, new_status } = data;
+    const { task_id, new_status, version } = data;
     const card = document.querySelector(`.kanban-card[data-task-id="${task_id}"]`);
     const column = document.querySelector(`.kanban-column[data-status="${new_status}"]`);
     if (card && column) {
-        column.appendChild(card);
+        card.dataset.version = version;
+        // Своё ещё не отправленное перемещение важнее
+        if (!pendingMoves.has(String(task_id))) column.appendChild(card);
     }
 });
 
@@ -0,0 +1,75 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock
+from typing import Callable, Dict, Set
+
+
+logger = logging.getLogger(__name__)
+
+
+class AssistantBusy(Exception):
+    pass
+
+
+class AssistantPool:
+    # Runs slow model calls on a fixed number of threads so Socket.IO handlers
+    # return immediately. Jobs beyond the workers wait in a bounded queue;
+    # past that, or past the per-user limit, new jobs are rejected.
+
+    def __init__(self, max_workers: int, max_queue: int, per_user: int) -> None:
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.per_user = per_user
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="assistant"
+        )
+        self._lock = Lock()
+        self._pending = 0
+        self._user_jobs: Dict[int, int] = {}
+        self._sid_jobs: Dict[str, Set[Event]] = {}
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def submit(self, user_id: int, sid: str, job: Callable[[Event], None]) -> Event:
+        # job receives an Event that is set when its client disconnects
+        with self._lock:
+            if self._user_jobs.get(user_id, 0) >= self.per_user:
+                raise AssistantBusy("Дождитесь ответа на предыдущий вопрос.")
+            if self._pending >= self.max_workers + self.max_queue:
+                raise AssistantBusy("Ассистент сейчас перегружен, попробуйте чуть позже.")
+            self._pending += 1
+            self._user_jobs[user_id] = self._user_jobs.get(user_id, 0) + 1
+            cancelled = Event()
+            self._sid_jobs.setdefault(sid, set()).add(cancelled)
+        self._executor.submit(self._run, user_id, sid, job, cancelled)
+        return cancelled
+
+    def cancel(self, sid: str) -> None:
+        with self._lock:
+            for cancelled in self._sid_jobs.pop(sid, ()):
+                cancelled.set()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, user_id: int, sid: str, job: Callable[[Event], None], cancelled: Event) -> None:
+        try:
+            # Skip jobs whose client left while they were still queued
+            if not cancelled.is_set():
+                job(cancelled)
+        except Exception:
+            # The executor's future is never read, so an error would vanish
+            logger.exception("Assistant job for user %s failed", user_id)
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._user_jobs[user_id] -= 1
+                if not self._user_jobs[user_id]:
+                    del self._user_jobs[user_id]
+                jobs = self._sid_jobs.get(sid)
+                if jobs is not None:
+                    jobs.discard(cancelled)
+                    if not jobs:
+                        del self._sid_jobs[sid]
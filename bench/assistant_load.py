@@ -0,0 +1,297 @@
+# Load test for the assistant: N Socket.IO clients each send user_message
+# and wait for the answer, then latency percentiles, throughput and (when the
+# app runs in this process) server thread usage are reported.
+#
+#   python -m bench.assistant_load --clients 20 --messages 5
+#       starts the app and a fake model backend in-process, no network needed;
+#       the app gets a temporary database filled by seeder.py
+#   python -m bench.assistant_load --url http://127.0.0.1:5000 --clients 20
+#       drives an already running server
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import requests
+import socketio
+
+from .fake_llm import FakeSettings, create_app
+
+
+SEEDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "seeder.py")
+
+CSRF_RE = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+PASSWORD = "bench-password"
+
+
+def percentile(values: List[float], share: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(share * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    return {
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": max(values) if values else None,
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def _csrf(session: requests.Session, url: str) -> str:
+    match = CSRF_RE.search(session.get(url).text)
+    return match.group(1) if match else ""
+
+
+def login(base_url: str, username: str) -> requests.Session:
+    # Registers the bench user on first use, then logs in
+    session = requests.Session()
+    session.post(base_url + "/register", data={
+        "csrf_token": _csrf(session, base_url + "/register"),
+        "username": username,
+        "password": PASSWORD,
+        "password2": PASSWORD,
+        "surname": "Bench",
+        "name": username,
+        "hire_date": "2024-01-01",
+        "birth_date": "1990-01-01",
+        "contact": "-",
+        "email": username + "@bench.local",
+    })
+    response = session.post(base_url + "/login", data={
+        "csrf_token": _csrf(session, base_url + "/login"),
+        "username": username,
+        "password": PASSWORD,
+    }, allow_redirects=False)
+    if response.status_code != 302:
+        raise RuntimeError(f"could not log in as {username}")
+    return session
+
+
+class ThreadSampler(threading.Thread):
+    # Counts the app server's threads: one per open HTTP/Socket.IO request,
+    # plus the assistant pool and the model client's hedging pool. The bench
+    # clients live in this process too, so they are not counted.
+
+    SERVER_THREADS = ("process_request_thread", "assistant", "llm")
+
+    def __init__(self, interval: float = 0.05) -> None:
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples: List[int] = []
+        self.running = True
+
+    def run(self) -> None:
+        while self.running:
+            self.samples.append(sum(
+                any(name in thread.name for name in self.SERVER_THREADS)
+                for thread in threading.enumerate()
+            ))
+            time.sleep(self.interval)
+
+
+def _wait_for(url: str) -> None:
+    for _ in range(200):
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.05)
+
+
+def _serve_fake(fake: FakeSettings, port: int) -> None:
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    create_app(fake).run(host="127.0.0.1", port=port, threaded=True)
+
+
+def serve_in_process(fake: FakeSettings, directory: str) -> str:
+    # The app in this process and the fake model backend in a child process,
+    # so the thread counts only show the app. The app's database and instance
+    # folder are created in directory, so the bench users never reach the
+    # developer's database.
+    database_url = "sqlite:///" + os.path.join(directory, "bench.db")
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["INSTANCE_PATH"] = os.path.join(directory, "instance")
+    subprocess.run(
+        [sys.executable, SEEDER],
+        cwd=os.path.dirname(SEEDER),
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+
+    fake_port = _free_port()
+    multiprocessing.Process(target=_serve_fake, args=(fake, fake_port), daemon=True).start()
+    _wait_for(f"http://127.0.0.1:{fake_port}/")
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    import config
+    from app.ai import TextGenerator
+    import app.web.app as web
+
+    web.text_generator = TextGenerator(
+        backends=[{
+            "name": "fake",
+            "base_url": f"http://127.0.0.1:{fake_port}/v1",
+            "key": "fake",
+            "model": "fake",
+        }],
+        timeout=config.llm_timeout,
+        hedge_after=config.llm_hedge_after,
+        retries=config.llm_retries,
+        max_connections=config.llm_max_connections,
+    )
+    port = _free_port()
+    threading.Thread(
+        target=web.socketio.run,
+        args=(web.app,),
+        kwargs={"host": "127.0.0.1", "port": port, "allow_unsafe_werkzeug": True},
+        daemon=True,
+    ).start()
+    base_url = f"http://127.0.0.1:{port}"
+    _wait_for(base_url + "/login")
+    return base_url
+
+
+def run_client(
+    base_url: str,
+    number: int,
+    messages: int,
+    repeat: bool,
+    timeout: float,
+    results: Dict[str, List[Any]],
+    lock: threading.Lock,
+) -> None:
+    session = login(base_url, f"bench-user-{number}")
+    client = socketio.Client(http_session=session)
+    finished = threading.Event()
+    state: Dict[str, Any] = {}
+
+    @client.on("assistant_chunk")
+    def on_chunk(data):
+        state.setdefault("first", time.perf_counter())
+
+    @client.on("assistant_done")
+    def on_done(data):
+        state["outcome"] = "ok"
+        finished.set()
+
+    @client.on("assistant_error")
+    def on_error(data):
+        state["outcome"] = "rejected" if data.get("error") == "busy" else "error"
+        finished.set()
+
+    client.connect(base_url, headers={"Cookie": "; ".join(
+        f"{name}={value}" for name, value in session.cookies.items()
+    )})
+    try:
+        for index in range(messages):
+            # Distinct questions unless --repeat, so the answer cache is bypassed
+            suffix = "" if repeat else f" (клиент {number}, вопрос {index})"
+            state.clear()
+            finished.clear()
+            started = time.perf_counter()
+            client.emit("user_message", {"text": "Кто работает над проектом Corporate Portal?" + suffix})
+            outcome = state.get("outcome") if finished.wait(timeout) else "timeout"
+            ended = time.perf_counter()
+            with lock:
+                results["outcomes"].append(outcome)
+                if outcome == "ok":
+                    results["latency"].append(ended - started)
+                    if "first" in state:
+                        results["ttft"].append(state["first"] - started)
+    finally:
+        client.disconnect()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Assistant Socket.IO load test")
+    parser.add_argument("--url", help="running server; omit to start the app in-process")
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=3, help="questions per client")
+    parser.add_argument("--repeat", action="store_true", help="every client asks the same question")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds to wait for an answer")
+    parser.add_argument("--fake-latency", type=float, default=0.2)
+    parser.add_argument("--fake-tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--fake-answer-tokens", type=int, default=60)
+    parser.add_argument("--fake-error-rate", type=float, default=0.0)
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    sampler = None
+    base_url = args.url
+    directory = None
+    if base_url is None:
+        directory = tempfile.TemporaryDirectory()
+        base_url = serve_in_process(FakeSettings(
+            latency=args.fake_latency,
+            tokens_per_second=args.fake_tokens_per_second,
+            answer_tokens=args.fake_answer_tokens,
+            error_rate=args.fake_error_rate,
+        ), directory.name)
+        sampler = ThreadSampler()
+        sampler.start()
+
+    results: Dict[str, List[Any]] = {"latency": [], "ttft": [], "outcomes": []}
+    lock = threading.Lock()
+    clients = [
+        threading.Thread(
+            target=run_client,
+            args=(base_url, number, args.messages, args.repeat, args.timeout, results, lock),
+        )
+        for number in range(args.clients)
+    ]
+    started = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    duration = time.perf_counter() - started
+
+    outcomes = results["outcomes"]
+    report: Dict[str, Any] = {
+        "clients": args.clients,
+        "questions": len(outcomes),
+        "answered": outcomes.count("ok"),
+        "rejected": outcomes.count("rejected"),
+        "errors": outcomes.count("error"),
+        "timeouts": outcomes.count("timeout"),
+        "duration": duration,
+        "throughput": outcomes.count("ok") / duration if duration else 0.0,
+        "latency": summarize(results["latency"]),
+        "time_to_first_token": summarize(results["ttft"]),
+    }
+    if sampler is not None:
+        sampler.running = False
+        report["server_threads"] = {
+            "max": max(sampler.samples),
+            "mean": sum(sampler.samples) / len(sampler.samples),
+        }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.json:
+        with open(args.json, "w") as file:
+            file.write(text)
+    if directory is not None:
+        directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+# Offline stand-in for an OpenAI-compatible chat completions API, for load
+# testing the assistant without network access. Point a backend at it:
+#
+#   python -m bench.fake_llm --port 8001 --latency 0.5 --tokens-per-second 50
+#   llm_backends = [{"name": "fake", "base_url": "http://127.0.0.1:8001/v1",
+#                    "key": "fake", "model": "fake"}]
+import argparse
+import json
+import random
+import time
+import uuid
+from typing import Any, Dict, Iterator
+
+from flask import Flask, Response, jsonify, request
+
+
+WORDS = (
+    "Сотрудник отдела подтвердил что задача по проекту будет выполнена в срок "
+    "и передана на проверку после согласования с руководителем"
+).split()
+
+
+class FakeSettings:
+    def __init__(
+        self,
+        latency: float = 0.2,
+        jitter: float = 0.0,
+        tokens_per_second: float = 50.0,
+        answer_tokens: int = 60,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        seed: int = 0,
+    ) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+
+
+def _usage(body: Dict[str, Any], completion_tokens: int) -> Dict[str, int]:
+    prompt_tokens = sum(
+        len(str(message.get("content") or "").split()) for message in body.get("messages", [])
+    )
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def create_app(settings: FakeSettings) -> Flask:
+    app = Flask(__name__)
+
+    def first_token_delay() -> float:
+        return max(0.0, settings.latency + settings.random.uniform(-1, 1) * settings.jitter)
+
+    def words(count: int) -> Iterator[str]:
+        for index in range(count):
+            yield ("" if index == 0 else " ") + settings.random.choice(WORDS)
+
+    @app.route("/v1/chat/completions", methods=["POST"])
+    def chat_completions():
+        body = request.get_json(force=True)
+        if settings.random.random() < settings.error_rate:
+            time.sleep(first_token_delay())
+            return jsonify({"error": {"message": "injected failure"}}), settings.error_status
+
+        completion_id = "chatcmpl-" + uuid.uuid4().hex
+        created = int(time.time())
+        model = body.get("model", "fake")
+        count = settings.answer_tokens
+        pause = 1 / settings.tokens_per_second if settings.tokens_per_second else 0
+
+        if not body.get("stream"):
+            time.sleep(first_token_delay() + pause * count)
+            return jsonify({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(words(count))},
+                    "finish_reason": "stop",
+                }],
+                "usage": _usage(body, count),
+            })
+
+        def chunk(delta: Dict[str, Any], finish_reason=None, **extra) -> str:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                **extra,
+            }
+            return "data: " + json.dumps(payload, ensure_ascii=False) + "\n\n"
+
+        def events() -> Iterator[str]:
+            time.sleep(first_token_delay())
+            yield chunk({"role": "assistant", "content": ""})
+            for word in words(count):
+                yield chunk({"content": word})
+                time.sleep(pause)
+            yield chunk({}, "stop")
+            if (body.get("stream_options") or {}).get("include_usage"):
+                payload = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [],
+                    "usage": _usage(body, count),
+                }
+                yield "data: " + json.dumps(payload) + "\n\n"
+            yield "data: [DONE]\n\n"
+
+        return Response(events(), mimetype="text/event-stream")
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible chat backend")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- seconds added to latency")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of failed requests, 0..1")
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    settings = FakeSettings(
+        latency=args.latency,
+        jitter=args.jitter,
+        tokens_per_second=args.tokens_per_second,
+        answer_tokens=args.answer_tokens,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        seed=args.seed,
+    )
+    create_app(settings).run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,476 @@
+# Synthetic company data at load-testing volumes. Rows are written with bulk
+# Core inserts in chunks, with ids assigned here so nothing has to be read
+# back, and secondary indexes are built once after the load. The same seed
+# and anchor date always give the same database.
+#
+#   python -m bench.generate --companies 10 --employees 10000 --chats 100 --messages 10000
+#       100k employees and 10M messages in the database of DATABASE_URL or
+#       config.database_url; everything in it is dropped first
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from flask import Flask
+from sqlalchemy import insert, text
+from werkzeug.security import generate_password_hash
+
+from app import database, search
+from app.models import (
+    db,
+    Chat,
+    Company,
+    Department,
+    Employee,
+    EventType,
+    HREvent,
+    KBRecord,
+    KnowledgeBase,
+    Message,
+    Project,
+    Role,
+    Status,
+    Task,
+    User,
+    chat_employee,
+    department_employee,
+    event_attendee,
+    project_employee,
+    task_employee,
+)
+
+
+SURNAMES = (
+    "Иванов Смирнов Кузнецов Попов Васильев Петров Соколов Михайлов Новиков Фёдоров "
+    "Морозов Волков Алексеев Лебедев Семёнов Егоров Павлов Козлов Степанов Николаев"
+).split()
+NAMES = (
+    "Александр Алексей Анна Дмитрий Елена Иван Ирина Максим Мария Михаил "
+    "Наталья Ольга Павел Сергей Светлана Татьяна Андрей Юлия Никита Екатерина"
+).split()
+PATRONYMICS = (
+    "Александрович Алексеевич Дмитриевич Иванович Михайлович Сергеевич Андреевич Павлович"
+).split()
+DEPARTMENTS = (
+    "Разработка Тестирование Дизайн Аналитика Маркетинг Продажи Поддержка Финансы "
+    "Кадры Юридический Инфраструктура Безопасность"
+).split()
+ROLES = (
+    ("Backend Developer", "Middle"),
+    ("Frontend Developer", "Junior"),
+    ("QA Engineer", "Senior"),
+    ("UI/UX Designer", "Middle"),
+    ("Data Analyst", "Middle"),
+    ("Project Manager", "Senior"),
+    ("HR Manager", "Middle"),
+    ("DevOps Engineer", "Senior"),
+    ("Sales Manager", "Junior"),
+    ("Support Engineer", "Junior"),
+)
+WORDS = (
+    "отчет задача проект релиз сервер клиент договор встреча созвон дизайн макет "
+    "тест ошибка исправление база данных отпуск премия бюджет план квартал срок "
+    "согласование презентация документация интеграция оплата счет аналитика метрика "
+    "пользователь интерфейс доступ пароль обновление миграция проверка ревью"
+).split()
+STATUSES = list(Status)
+EVENT_TYPES = list(EventType)
+
+# Distinct message texts messages are drawn from
+MESSAGE_TEXTS = 10000
+
+# Password of every generated login user (user<employee id>)
+PASSWORD = "bench-password"
+
+# The app's instance folder, where a relative SQLite URL points
+INSTANCE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "instance")
+
+
+class Progress:
+    # Rows written per table, printed at most once per second
+
+    def __init__(self, table: str, total: int) -> None:
+        self.table = table
+        self.total = total
+        self.done = 0
+        self.started = time.perf_counter()
+        self.printed = self.started
+
+    def add(self, rows: int) -> None:
+        self.done += rows
+        now = time.perf_counter()
+        if now - self.printed >= 1 or self.done >= self.total:
+            self.printed = now
+            rate = self.done / max(now - self.started, 1e-9)
+            print(
+                f"{self.table}: {self.done:,} / {self.total:,} ({rate:,.0f} rows/s)",
+                file=sys.stderr,
+                flush=True,
+            )
+
+
+class Generator:
+    def __init__(self, args: argparse.Namespace, connection) -> None:
+        self.args = args
+        self.connection = connection
+        self.random = random.Random(args.seed)
+        self.anchor = datetime.combine(args.anchor, datetime.min.time())
+        self.counts: Dict[str, int] = {}
+
+    def insert(self, table, total: int, rows: Iterable[Dict[str, Any]]) -> None:
+        # Executemany in chunks, one transaction per chunk
+        progress = Progress(table.name, total)
+        chunk: List[Dict[str, Any]] = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= self.args.chunk:
+                self._flush(table, chunk, progress)
+                chunk = []
+        if chunk:
+            self._flush(table, chunk, progress)
+        self.counts[table.name] = self.counts.get(table.name, 0) + progress.done
+
+    def _flush(self, table, chunk: List[Dict[str, Any]], progress: Progress) -> None:
+        self.connection.execute(insert(table), chunk)
+        self.connection.commit()
+        progress.add(len(chunk))
+
+    def _stamp(self, moment: Optional[datetime] = None) -> Dict[str, datetime]:
+        moment = moment or self.anchor
+        return {"created_at": moment, "updated_at": moment}
+
+    def _words(self, low: int, high: int) -> str:
+        return " ".join(self.random.choices(WORDS, k=self.random.randint(low, high)))
+
+    def _day(self, before: int, after: int) -> date:
+        return (self.anchor + timedelta(days=self.random.randint(-before, after))).date()
+
+    # Ids are contiguous per company, so company c (0-based) owns
+    # employees c * employees + 1 .. (c + 1) * employees, and so on
+
+    def _ids(self, company: int, per_company: int) -> range:
+        return range(company * per_company + 1, (company + 1) * per_company + 1)
+
+    def run(self) -> Dict[str, int]:
+        a = self.args
+        self.insert(Role.__table__, len(ROLES), (
+            dict(id=number + 1, name=name, grade=grade, description=name, **self._stamp())
+            for number, (name, grade) in enumerate(ROLES)
+        ))
+        self.insert(Company.__table__, a.companies, (
+            dict(id=c + 1, name=f"Компания {c + 1}", description=self._words(5, 15), **self._stamp())
+            for c in range(a.companies)
+        ))
+        self.insert(KnowledgeBase.__table__, a.companies, (
+            dict(id=c + 1, company_id=c + 1, **self._stamp()) for c in range(a.companies)
+        ))
+        self.insert(Department.__table__, a.companies * a.departments, (
+            dict(
+                id=department_id,
+                name=f"{DEPARTMENTS[number % len(DEPARTMENTS)]} {number + 1}",
+                description=self._words(3, 10),
+                company_id=c + 1,
+                **self._stamp()
+            )
+            for c in range(a.companies)
+            for number, department_id in enumerate(self._ids(c, a.departments))
+        ))
+        self._employees()
+        self._projects()
+        self._tasks()
+        self._chats()
+        self._messages()
+        self._knowledge()
+        self._events()
+        return self.counts
+
+    def _employees(self) -> None:
+        a = self.args
+        total = a.companies * a.employees
+
+        def rows() -> Iterator[Dict[str, Any]]:
+            for c in range(a.companies):
+                for employee_id in self._ids(c, a.employees):
+                    yield dict(
+                        id=employee_id,
+                        surname=self.random.choice(SURNAMES),
+                        name=self.random.choice(NAMES),
+                        patronymic=self.random.choice(PATRONYMICS) if self.random.random() < 0.7 else None,
+                        hire_date=self._day(3650, 0),
+                        birth_date=self._day(20000, -7000),
+                        contacts=f"Telegram: @employee{employee_id}",
+                        email=f"employee{employee_id}@company{c + 1}.example",
+                        company_id=c + 1,
+                        role_id=self.random.randint(1, len(ROLES)),
+                        user_id=employee_id if employee_id - c * a.employees <= a.users else None,
+                        **self._stamp()
+                    )
+
+        # One password hash for every login user; hashing per row would
+        # take longer than the whole load
+        password_hash = generate_password_hash(PASSWORD)
+        self.insert(User.__table__, a.companies * min(a.users, a.employees), (
+            dict(id=employee_id, username=f"user{employee_id}", password_hash=password_hash)
+            for c in range(a.companies)
+            for employee_id in self._ids(c, a.employees)[:a.users]
+        ))
+        self.insert(Employee.__table__, total, rows())
+        # Every employee in one department; the first of each department leads it
+        self.insert(department_employee, total, (
+            dict(
+                department_id=self._ids(c, a.departments)[number % a.departments],
+                employee_id=employee_id,
+                is_lead=number < a.departments,
+            )
+            for c in range(a.companies)
+            for number, employee_id in enumerate(self._ids(c, a.employees))
+        ))
+
+    def _projects(self) -> None:
+        a = self.args
+        self.insert(Project.__table__, a.companies * a.projects, (
+            dict(
+                id=project_id,
+                name=f"Проект {project_id} {self.random.choice(WORDS)}",
+                description=self._words(5, 20),
+                status=self.random.choice(STATUSES),
+                company_id=c + 1,
+                responsible_dept_id=self.random.choice(self._ids(c, a.departments)),
+                **self._stamp()
+            )
+            for c in range(a.companies)
+            for project_id in self._ids(c, a.projects)
+        ))
+        members = min(a.project_members, a.employees)
+        # project id -> member ids, reused to staff the project's tasks
+        self.project_members: Dict[int, List[int]] = {
+            project_id: self.random.sample(self._ids(c, a.employees), members)
+            for c in range(a.companies)
+            for project_id in self._ids(c, a.projects)
+        }
+        self.insert(project_employee, len(self.project_members) * members, (
+            dict(project_id=project_id, employee_id=employee_id)
+            for project_id, employee_ids in self.project_members.items()
+            for employee_id in employee_ids
+        ))
+
+    def _tasks(self) -> None:
+        a = self.args
+        total = a.companies * a.projects * a.tasks
+        assignees: List[Dict[str, int]] = []
+
+        def rows() -> Iterator[Dict[str, Any]]:
+            task_id = 0
+            for project_id, members in self.project_members.items():
+                for _ in range(a.tasks):
+                    task_id += 1
+                    start = self._day(365, 180)
+                    for employee_id in self.random.sample(members, min(len(members), self.random.randint(1, 2))):
+                        assignees.append(dict(task_id=task_id, employee_id=employee_id))
+                    yield dict(
+                        id=task_id,
+                        name=f"Задача {task_id}: {self._words(2, 5)}",
+                        description=self._words(5, 30),
+                        start_date=start,
+                        due_date=start + timedelta(days=self.random.randint(1, 45)),
+                        priority=self.random.randint(1, 5),
+                        status=self.random.choice(STATUSES),
+                        project_id=project_id,
+                        version=1,
+                        **self._stamp()
+                    )
+
+        self.insert(Task.__table__, total, rows())
+        self.insert(task_employee, len(assignees), assignees)
+
+    def _chats(self) -> None:
+        a = self.args
+        self.insert(Chat.__table__, a.companies * a.chats, (
+            dict(id=chat_id, name=f"Чат {chat_id}", **self._stamp())
+            for c in range(a.companies)
+            for chat_id in self._ids(c, a.chats)
+        ))
+        members = min(a.chat_members, a.employees)
+        # chat id -> member ids, the senders of the chat's messages
+        self.chat_members: Dict[int, List[int]] = {}
+        for c in range(a.companies):
+            employees = self._ids(c, a.employees)
+            for chat_id in self._ids(c, a.chats):
+                chosen = set(self.random.sample(employees, members))
+                # Login users are in every chat of their company, so the
+                # benchmarks can open any chat as them
+                chosen.update(employees[:a.users])
+                self.chat_members[chat_id] = sorted(chosen)
+        self.insert(chat_employee, sum(map(len, self.chat_members.values())), (
+            dict(chat_id=chat_id, employee_id=employee_id)
+            for chat_id, employee_ids in self.chat_members.items()
+            for employee_id in employee_ids
+        ))
+
+    def _messages(self) -> None:
+        a = self.args
+        total = a.companies * a.chats * a.messages
+        # Each chat's messages end at the anchor, a few minutes apart. Texts
+        # come from a pool since composing 10M of them dominates the load.
+        step = timedelta(minutes=7)
+        texts = [self._words(3, 20) for _ in range(MESSAGE_TEXTS)]
+
+        def rows() -> Iterator[Dict[str, Any]]:
+            message_id = 0
+            for chat_id, members in self.chat_members.items():
+                moment = self.anchor - step * a.messages
+                for _ in range(a.messages):
+                    message_id += 1
+                    moment += step
+                    yield dict(
+                        id=message_id,
+                        content=self.random.choice(texts),
+                        timestamp=moment,
+                        chat_id=chat_id,
+                        sender_id=self.random.choice(members),
+                        created_at=moment,
+                        updated_at=moment,
+                    )
+
+        self.insert(Message.__table__, total, rows())
+
+    def _knowledge(self) -> None:
+        a = self.args
+        self.insert(KBRecord.__table__, a.companies * a.kb_records, (
+            dict(
+                id=record_id,
+                kb_id=c + 1,
+                creator_id=self.random.choice(self._ids(c, a.employees)),
+                content=self._words(20, 80),
+                importance=self.random.randint(0, 100),
+                **self._stamp()
+            )
+            for c in range(a.companies)
+            for record_id in self._ids(c, a.kb_records)
+        ))
+
+    def _events(self) -> None:
+        a = self.args
+        attendees: List[Dict[str, int]] = []
+
+        def rows() -> Iterator[Dict[str, Any]]:
+            for c in range(a.companies):
+                employees = self._ids(c, a.employees)
+                for event_id in self._ids(c, a.events):
+                    starts = datetime.combine(self._day(180, 180), datetime.min.time()) + timedelta(
+                        hours=self.random.randint(9, 18)
+                    )
+                    for employee_id in self.random.sample(employees, min(len(employees), 10)):
+                        attendees.append(dict(event_id=event_id, employee_id=employee_id))
+                    yield dict(
+                        id=event_id,
+                        name=f"Событие {event_id}",
+                        description=self._words(5, 15),
+                        starts_at=starts,
+                        ends_at=starts + timedelta(hours=self.random.randint(1, 8)),
+                        type=self.random.choice(EVENT_TYPES),
+                        location=self.random.choice(["Офис", "Онлайн", "Парк", "Конференц-зал"]),
+                        organizer_id=self.random.choice(employees),
+                        **self._stamp()
+                    )
+
+        self.insert(HREvent.__table__, a.companies * a.events, rows())
+        self.insert(event_attendee, len(attendees), attendees)
+
+
+def _secondary_indexes() -> List:
+    return [index for table in db.metadata.sorted_tables for index in table.indexes]
+
+
+def _reset_sequences(connection) -> None:
+    # Explicit ids leave PostgreSQL sequences behind the data
+    for table in db.metadata.sorted_tables:
+        if "id" in table.c and table.c.id.primary_key:
+            connection.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('\"{table.name}\"', 'id'), "
+                f"coalesce((SELECT max(id) FROM \"{table.name}\"), 0) + 1, false)"
+            ))
+    connection.commit()
+
+
+def generate(args: argparse.Namespace) -> Dict[str, int]:
+    engine = db.engine
+    started = time.perf_counter()
+    db.drop_all()
+    db.create_all()
+    if search.supported(engine):
+        with engine.begin() as connection:
+            connection.execute(text("DROP TABLE IF EXISTS search_index"))
+            for name in search.TRIGGERS:
+                connection.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+    indexes = _secondary_indexes()
+    with engine.connect() as connection:
+        if engine.dialect.name == "sqlite":
+            # Nothing to lose if the load is interrupted; it is rerun anyway
+            connection.exec_driver_sql("PRAGMA synchronous=OFF")
+        # Built once after the load instead of updated row by row
+        for index in indexes:
+            index.drop(connection)
+        connection.commit()
+        counts = Generator(args, connection).run()
+        print(f"indexes: building {len(indexes)}", file=sys.stderr, flush=True)
+        for index in indexes:
+            index.create(connection)
+        connection.commit()
+        if engine.dialect.name == "postgresql":
+            _reset_sequences(connection)
+    if args.search_index and search.supported(engine):
+        print("search_index: building", file=sys.stderr, flush=True)
+        search.install(engine)
+    print(f"done in {time.perf_counter() - started:.1f} s", file=sys.stderr, flush=True)
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate synthetic data for load testing")
+    parser.add_argument("--companies", type=int, default=1)
+    parser.add_argument("--employees", type=int, default=1000, help="per company")
+    parser.add_argument("--users", type=int, default=10, help="login users per company (user<id> / bench-password)")
+    parser.add_argument("--departments", type=int, default=10, help="per company")
+    parser.add_argument("--projects", type=int, default=50, help="per company")
+    parser.add_argument("--project-members", type=int, default=10)
+    parser.add_argument("--tasks", type=int, default=20, help="per project")
+    parser.add_argument("--chats", type=int, default=20, help="per company")
+    parser.add_argument("--chat-members", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=500, help="per chat")
+    parser.add_argument("--kb-records", type=int, default=200, help="per company")
+    parser.add_argument("--events", type=int, default=50, help="per company")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--anchor", type=date.fromisoformat, default=date(2025, 1, 1),
+        help="dates are spread around this day (YYYY-MM-DD)",
+    )
+    parser.add_argument("--chunk", type=int, default=10000, help="rows per insert")
+    parser.add_argument(
+        "--no-search-index", dest="search_index", action="store_false",
+        help="leave the full-text index to be built when the app starts",
+    )
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        counts = generate(args)
+    for table, rows in counts.items():
+        print(f"{table}: {rows:,}")
+
+
+def create_app() -> Flask:
+    app = Flask(__name__, instance_path=INSTANCE_PATH)
+    database.configure(app)
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    with app.app_context():
+        database.tune(db.engine)
+    return app
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+# Route benchmarks: for each scale a database is generated with
+# bench.generate, then pages and Socket.IO events are driven through the
+# Flask and Socket.IO test clients. Each endpoint reports p50/p95 latency,
+# SQL queries per call and peak Python memory of one call.
+#
+#   python -m bench.routes --scales small,medium --json bench.json
+#   python -m bench.routes --baseline bench.json
+#       also fails when an endpoint needs more queries than in the baseline
+#       or its median latency grew by more than --tolerance (and 5 ms)
+#
+# The run fails (exit code 1) when an endpoint errors, or when its query
+# count grows with the data between the smallest and largest scale, which
+# is how an N+1 shows up.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+from .assistant_load import summarize
+from .generate import PASSWORD
+
+
+# bench.generate arguments of each scale
+SCALES = {
+    "small": {
+        "employees": 100, "projects": 10, "tasks": 10, "chats": 5,
+        "messages": 200, "kb-records": 50, "events": 20,
+    },
+    "medium": {
+        "employees": 1000, "projects": 50, "tasks": 20, "chats": 20,
+        "messages": 2000, "kb-records": 200, "events": 50,
+    },
+    "large": {
+        "employees": 5000, "projects": 100, "tasks": 40, "chats": 50,
+        "messages": 20000, "kb-records": 500, "events": 100,
+    },
+}
+
+# Latency changes smaller than this many seconds are noise, whatever the ratio
+MIN_LATENCY_GROWTH = 0.005
+
+# The generator's first login user and its anchor month
+USERNAME = "user1"
+MONTH = ("2024-12-29", "2025-02-08")
+
+
+class QueryCounter:
+    def __init__(self) -> None:
+        self.count = 0
+
+    def __call__(self, *args) -> None:
+        self.count += 1
+
+
+def measure(
+    call: Callable[[int], None],
+    counter: QueryCounter,
+    iterations: int,
+    warmup: int,
+) -> Dict[str, Any]:
+    # Warm-up calls fill the caches, so the numbers are for steady state
+    for number in range(warmup):
+        call(number)
+    timings: List[float] = []
+    queries: List[int] = []
+    for number in range(warmup, warmup + iterations):
+        counter.count = 0
+        started = time.perf_counter()
+        call(number)
+        timings.append(time.perf_counter() - started)
+        queries.append(counter.count)
+    # Memory is traced in a separate call; tracing slows everything down
+    tracemalloc.start()
+    call(warmup + iterations)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "latency": summarize(timings),
+        "queries": sorted(queries)[len(queries) // 2],
+        "max_queries": max(queries),
+        "peak_memory_kib": peak // 1024,
+    }
+
+
+def run_scale(iterations: int, warmup: int) -> Dict[str, Any]:
+    # Runs in a child process whose DATABASE_URL points at the scale's database
+    import logging
+
+    from sqlalchemy import event
+
+    import app.web.app as web
+    from app.models import db, Task
+
+    logging.getLogger("app").setLevel(logging.ERROR)
+    web.app.config["WTF_CSRF_ENABLED"] = False
+
+    # The assistant answers at once, so only the app's own work is measured
+    def answer(history, **kwargs):
+        yield "Ответ."
+
+    web.text_generator.stream = answer
+
+    client = web.app.test_client()
+    response = client.post("/login", data={"username": USERNAME, "password": PASSWORD})
+    if response.status_code != 302:
+        raise RuntimeError(f"could not log in as {USERNAME}")
+    sockets = web.socketio.test_client(web.app, flask_test_client=client)
+
+    counter = QueryCounter()
+    with web.app.app_context():
+        event.listen(db.engine, "before_cursor_execute", counter)
+        task_id = db.session.scalar(db.select(Task.id).order_by(Task.id).limit(1))
+
+    errors: List[str] = []
+
+    def page(url: str) -> Callable[[int], None]:
+        def call(number: int) -> None:
+            status = client.get(url).status_code
+            if status != 200:
+                errors.append(f"GET {url} answered {status}")
+        return call
+
+    statuses = ["todo", "in_progress", "review", "done"]
+    version = {"value": None}
+
+    def move_task(number: int) -> None:
+        if version["value"] is None:
+            with web.app.app_context():
+                version["value"] = db.session.get(Task, task_id).version
+        result = sockets.emit("move_task", {
+            "task_id": task_id,
+            "new_status": statuses[number % len(statuses)],
+            "version": version["value"],
+        }, callback=True)
+        if not result or not result.get("ok"):
+            errors.append(f"move_task answered {result}")
+            version["value"] = None
+        else:
+            version["value"] = result["version"]
+
+    def user_message(number: int) -> None:
+        # Distinct questions, so the answer cache does not serve them
+        sockets.get_received()
+        sockets.emit("user_message", {"text": f"Кто работает над проектом номер {number}?"})
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            names = [message["name"] for message in sockets.get_received()]
+            if "assistant_done" in names:
+                return
+            if "assistant_error" in names:
+                break
+            time.sleep(0.001)
+        errors.append("user_message got no answer")
+
+    endpoints = {
+        "GET /tasks": page("/tasks"),
+        "GET /tasks/board": page("/tasks/board"),
+        "GET /calendar/": page("/calendar/"),
+        "GET /calendar/range": page(f"/calendar/range?start={MONTH[0]}&end={MONTH[1]}"),
+        "GET /company/<id>": page("/company/1"),
+        "GET /employees": page("/employees"),
+        "GET /chat/<id>": page("/chat/1"),
+        "socket move_task": move_task,
+        "socket user_message": user_message,
+    }
+    results = {}
+    for name, call in endpoints.items():
+        results[name] = measure(call, counter, iterations, warmup)
+    sockets.disconnect()
+    return {"endpoints": results, "errors": sorted(set(errors))}
+
+
+def _generate(scale: str, database_url: str) -> None:
+    arguments = [sys.executable, "-m", "bench.generate"]
+    for name, value in SCALES[scale].items():
+        arguments += [f"--{name}", str(value)]
+    subprocess.run(
+        arguments,
+        env=dict(os.environ, DATABASE_URL=database_url),
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+
+
+def _measure_scale(
+    scale: str, database_url: str, instance_path: str, iterations: int, warmup: int
+) -> Dict[str, Any]:
+    # The app writes its retrieval index to the instance folder, so the
+    # child gets a temporary one next to the database instead of the repo's
+    output = subprocess.run(
+        [
+            sys.executable, "-m", "bench.routes", "--run-scale",
+            "--iterations", str(iterations), "--warmup", str(warmup),
+        ],
+        env=dict(os.environ, DATABASE_URL=database_url, INSTANCE_PATH=instance_path),
+        stdout=subprocess.PIPE,
+        check=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def check(report: Dict[str, Any], baseline: Optional[Dict[str, Any]], slack: int, tolerance: float) -> List[str]:
+    failures = []
+    scales = report["scales"]
+    for scale, result in scales.items():
+        failures += [f"{scale}: {error}" for error in result["errors"]]
+    # Query counts must not follow the amount of data
+    names = list(scales)
+    if len(names) > 1:
+        smallest, largest = scales[names[0]]["endpoints"], scales[names[-1]]["endpoints"]
+        for endpoint, result in largest.items():
+            grown = result["queries"] - smallest[endpoint]["queries"]
+            if grown > slack:
+                failures.append(
+                    f"{endpoint}: {smallest[endpoint]['queries']} queries at {names[0]} but "
+                    f"{result['queries']} at {names[-1]} (N+1?)"
+                )
+    if baseline:
+        for scale, result in scales.items():
+            before = baseline["scales"].get(scale, {}).get("endpoints", {})
+            for endpoint, now in result["endpoints"].items():
+                old = before.get(endpoint)
+                if old is None:
+                    continue
+                if now["queries"] > old["queries"]:
+                    failures.append(
+                        f"{scale} {endpoint}: {now['queries']} queries, baseline {old['queries']}"
+                    )
+                # The median; p95 of a few calls is too noisy to fail on
+                p50, old_p50 = now["latency"]["p50"], old["latency"]["p50"]
+                if p50 > old_p50 * (1 + tolerance) and p50 - old_p50 > MIN_LATENCY_GROWTH:
+                    failures.append(
+                        f"{scale} {endpoint}: p50 {now['latency']['p50'] * 1000:.1f} ms, "
+                        f"baseline {old['latency']['p50'] * 1000:.1f} ms"
+                    )
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Route latency, query count and memory benchmarks")
+    parser.add_argument("--scales", default="small,medium", help=f"any of {', '.join(SCALES)}, smallest first")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--baseline", help="report of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed p50 growth over the baseline")
+    parser.add_argument("--query-slack", type=int, default=3, help="allowed query growth between scales")
+    parser.add_argument("--run-scale", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scale:
+        print(json.dumps(run_scale(args.iterations, args.warmup)))
+        return
+
+    report: Dict[str, Any] = {"commit": _commit(), "iterations": args.iterations, "scales": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in args.scales.split(","):
+            database_url = "sqlite:///" + os.path.join(directory, f"{scale}.db")
+            print(f"{scale}: generating", file=sys.stderr, flush=True)
+            _generate(scale, database_url)
+            print(f"{scale}: measuring", file=sys.stderr, flush=True)
+            instance_path = os.path.join(directory, f"{scale}-instance")
+            result = _measure_scale(scale, database_url, instance_path, args.iterations, args.warmup)
+            report["scales"][scale] = dict(result, data=SCALES[scale])
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    failures = check(report, baseline, args.query_slack, args.tolerance)
+    report["failures"] = failures
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.json:
+        with open(args.json, "w") as file:
+            file.write(text)
+    if failures:
+        for failure in failures:
+            print(f"FAIL {failure}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
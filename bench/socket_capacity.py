@@ -0,0 +1,167 @@
+# Idle Socket.IO connections per async mode: for each mode serve.py is
+# started in a child process, N clients connect over WebSocket and join a
+# kanban board, then connect latency, how many stayed connected, HTTP
+# latency with all of them open, and the server's memory and OS threads
+# are reported.
+#
+#   python -m bench.socket_capacity --modes threading,gevent,eventlet --clients 1000
+#       modes whose package is not installed are reported as skipped
+#
+# The servers share a temporary database filled by seeder.py.
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List
+
+import socketio
+
+from .assistant_load import SEEDER, _free_port, _wait_for, login, summarize
+
+
+SERVE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "serve.py")
+
+
+def _process_status(pid: int) -> Dict[str, int]:
+    # Resident memory and OS thread count of the server (Linux only)
+    status: Dict[str, int] = {}
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            for line in file:
+                name, _, value = line.partition(":")
+                if name == "VmRSS":
+                    status["rss_mb"] = int(value.split()[0]) // 1024
+                elif name == "Threads":
+                    status["threads"] = int(value)
+    except OSError:
+        pass
+    return status
+
+
+def _connect(base_url: str, cookie: str, timeout: float, results: Dict[str, List[Any]], lock) -> None:
+    client = socketio.Client(reconnection=False)
+    started = time.perf_counter()
+    try:
+        client.connect(
+            base_url,
+            headers={"Cookie": cookie},
+            transports=["websocket"],
+            wait_timeout=timeout,
+        )
+        client.call("join_board", {}, timeout=timeout)
+    except Exception as error:
+        with lock:
+            results["errors"].append(type(error).__name__)
+        return
+    with lock:
+        results["connect"].append(time.perf_counter() - started)
+        results["clients"].append(client)
+
+
+def measure(
+    mode: str,
+    clients: int,
+    concurrency: int,
+    hold: float,
+    timeout: float,
+    env: Dict[str, str],
+) -> Dict[str, Any]:
+    if mode != "threading" and importlib.util.find_spec(mode) is None:
+        return {"mode": mode, "skipped": f"{mode} is not installed"}
+    port = _free_port()
+    server = subprocess.Popen(
+        [sys.executable, SERVE, "--mode", mode, "--host", "127.0.0.1", "--port", str(port), "--workers", "1"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    results: Dict[str, List[Any]] = {"connect": [], "errors": [], "clients": []}
+    try:
+        _wait_for(base_url + "/login")
+        session = login(base_url, "bench-sockets")
+        cookie = "; ".join(f"{name}={value}" for name, value in session.cookies.items())
+        baseline = _process_status(server.pid)
+        lock = threading.Lock()
+        started = time.perf_counter()
+        # Connect in waves of `concurrency` so the bench does not time itself out
+        for first in range(0, clients, concurrency):
+            wave = [
+                threading.Thread(target=_connect, args=(base_url, cookie, timeout, results, lock))
+                for _ in range(first, min(clients, first + concurrency))
+            ]
+            for thread in wave:
+                thread.start()
+            for thread in wave:
+                thread.join()
+        connect_duration = time.perf_counter() - started
+        time.sleep(hold)
+        # An ordinary page request while every socket is open and idle
+        latencies = []
+        for _ in range(20):
+            request_started = time.perf_counter()
+            session.get(base_url + "/realtime/stats", timeout=timeout)
+            latencies.append(time.perf_counter() - request_started)
+        stats = session.get(base_url + "/realtime/stats", timeout=timeout).json()
+        loaded = _process_status(server.pid)
+        return {
+            "mode": mode,
+            "clients": clients,
+            "connected": sum(client.connected for client in results["clients"]),
+            "errors": len(results["errors"]),
+            "error_types": sorted(set(results["errors"])),
+            "server_connections": stats["rooms"]["connections"],
+            "connect_duration": connect_duration,
+            "connect_latency": summarize(results["connect"]),
+            "http_latency_under_load": summarize(latencies),
+            "server_rss_mb": {"idle": baseline.get("rss_mb"), "loaded": loaded.get("rss_mb")},
+            "server_threads": {"idle": baseline.get("threads"), "loaded": loaded.get("threads")},
+        }
+    finally:
+        # Stopping the server closes every socket; disconnecting the clients
+        # one by one first would take longer than the measurement
+        server.terminate()
+        server.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Concurrent idle Socket.IO connections per async mode")
+    parser.add_argument("--modes", default="threading,gevent,eventlet")
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50, help="clients connecting at once")
+    parser.add_argument("--hold", type=float, default=5.0, help="seconds to keep the sockets idle")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(
+            os.environ,
+            DATABASE_URL="sqlite:///" + os.path.join(directory, "bench.db"),
+            INSTANCE_PATH=os.path.join(directory, "instance"),
+        )
+        subprocess.run(
+            [sys.executable, SEEDER],
+            cwd=os.path.dirname(SEEDER),
+            env=env,
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+        report = [
+            measure(mode, args.clients, args.concurrency, args.hold, args.timeout, env)
+            for mode in args.modes.split(",")
+        ]
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.json:
+        with open(args.json, "w") as file:
+            file.write(text)
+
+
+if __name__ == "__main__":
+    main()
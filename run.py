@@ -1,4 +1,14 @@
+import os
+
 from app.web.app import app, socketio
 
 
-socketio.run(app, debug=True, host="0.0.0.0", port=5000)
\ No newline at end of file
+# A development server; FLASK_DEBUG=1 turns on the debugger and reloader.
+# Several of them (one PORT each, same store_url and socketio_message_queue
+# in config.py) can sit behind a load balancer; use serve.py in production.
+socketio.run(
+    app,
+    debug=os.environ.get('FLASK_DEBUG', '0') == '1',
+    host=os.environ.get('HOST', '0.0.0.0'),
+    port=int(os.environ.get('PORT', 5000))
+)
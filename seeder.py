@@ -1,5 +1,6 @@
 from flask import Flask
 from datetime import date, datetime, timedelta
+from app import database
 from app.models import db  # Импортируй свой db, если путь другой
 from app.models import (  # Импортируй все твои модели правильно!
     Company, Department, Role, Employee, Project, Task,
@@ -260,12 +261,13 @@ def seed_data():
 
 
 app = Flask(__name__)
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///app.db"
+database.configure(app)
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 app.config["SECRET_KEY"] = "your_secret_key"
 
 db.init_app(app)
 
 with app.app_context():
+    database.tune(db.engine)
     seed_data()
     print("Data seeded successfully!")
\ No newline at end of file
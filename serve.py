@@ -0,0 +1,102 @@
+# Production entry point: no debugger and no reloader, an async server
+# chosen by --mode (config.async_mode by default) and --workers processes.
+#
+#   python serve.py --mode gevent --workers 4 --port 5000
+#       four processes on ports 5000-5003 behind a load balancer with
+#       sticky sessions; they need a shared store_url and
+#       socketio_message_queue in config.py
+import argparse
+import signal
+import subprocess
+import sys
+
+import config
+
+
+MODES = ("threading", "gevent", "eventlet")
+
+
+def patch(mode: str) -> None:
+    # Green threads need blocking I/O in the standard library (sockets used
+    # by the model client and Redis, threads, queues, sleeps) and in the
+    # PostgreSQL driver to yield instead of blocking the process. Must run
+    # before the app is imported. SQLite calls cannot yield; use PostgreSQL
+    # for busy green-thread servers.
+    if mode == "gevent":
+        from gevent import monkey
+
+        monkey.patch_all()
+        try:
+            from psycogreen.gevent import patch_psycopg
+        except ImportError:
+            pass
+        else:
+            patch_psycopg()
+    elif mode == "eventlet":
+        import eventlet
+
+        eventlet.monkey_patch()
+        try:
+            from eventlet.support.psycopg2_patcher import make_psycopg_green
+            make_psycopg_green()
+        except ImportError:
+            pass
+
+
+def serve(mode: str, host: str, port: int) -> None:
+    patch(mode)
+    config.async_mode = mode
+    from app.web.app import app, socketio
+
+    socketio.run(
+        app,
+        host=host,
+        port=port,
+        debug=False,
+        use_reloader=False,
+        log_output=False,
+        allow_unsafe_werkzeug=mode == "threading"
+    )
+
+
+def supervise(mode: str, host: str, port: int, workers: int) -> None:
+    # One child process per worker; stopping the supervisor stops them all
+    if config.store_url == "memory://" or not config.socketio_message_queue:
+        sys.exit("several workers need a shared store_url and socketio_message_queue in config.py")
+    children = [
+        subprocess.Popen([
+            sys.executable, __file__,
+            "--mode", mode, "--host", host, "--port", str(port + number), "--workers", "1",
+        ])
+        for number in range(workers)
+    ]
+
+    def stop(signum, frame):
+        for child in children:
+            child.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for child in children:
+            child.wait()
+    except KeyboardInterrupt:
+        stop(None, None)
+        for child in children:
+            child.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the app in production")
+    parser.add_argument("--mode", choices=MODES, default=config.async_mode)
+    parser.add_argument("--host", default=config.server_host)
+    parser.add_argument("--port", type=int, default=config.server_port)
+    parser.add_argument("--workers", type=int, default=config.server_workers)
+    args = parser.parse_args()
+    if args.workers > 1:
+        supervise(args.mode, args.host, args.port, args.workers)
+    else:
+        serve(args.mode, args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()